@@ -1,11 +1,15 @@
 import json
 from collections import defaultdict
+from contextlib import contextmanager
 import time
-from verl import DataProto
-import torch
-from rewards import accuracy_reward
+from typing import TYPE_CHECKING
+from rewards import accuracy_reward, async_accuracy_reward, fast_accuracy_reward, set_verifier_cache, set_judge_options
+
+# torch and verl are only needed to build the reward tensor; Ray scoring actors and
+# benchmark processes that only call `score_items` never import them
+if TYPE_CHECKING:
+    from verl import DataProto
 
-strtime = time.strftime("%Y%m%d")
 
 def process_questions(data):
     # 按问题分组存储所有条目
@@ -39,42 +43,400 @@ def process_questions(data):
     return processed
 
 
+def prompt_group(item, uids=None):
+    """Prompt group of a decoded item: its `uid` when the trainer provides it, otherwise prompt and reference answer."""
+    i, messages, _, ground_truth, _, limit, _ = item
+    if uids is not None:
+        return uids[i]
+    return json.dumps([list(messages), ground_truth, limit], ensure_ascii=False, sort_keys=True, default=str)
+
+
+def fallback_scores(items, raw_scores, policy, uids=None):
+    """Scores for the items whose raw score is None (missed the reward deadline or the judge failed).
+
+    'zero' scores them 0.0, 'group_mean' with the mean raw score of the scored
+    completions of the same prompt group (0.0 if none was scored), which
+    leaves them with no advantage in GRPO.
+    """
+    missed = [item for item in items if raw_scores[item[0]] is None]
+    if policy == 'zero' or not missed:
+        return {item[0]: 0.0 for item in missed}
+
+    group_scores = defaultdict(list)
+    for item in items:
+        if raw_scores[item[0]] is not None:
+            group_scores[prompt_group(item, uids)].append(raw_scores[item[0]])
+    scores = {}
+    for item in missed:
+        scored = group_scores.get(prompt_group(item, uids))
+        scores[item[0]] = sum(scored) / len(scored) if scored else 0.0
+    return scores
+
+
+def dedup_group_items(items, uids=None):
+    """Find byte-identical completions within each prompt group.
+
+    Completions are compared after stripping `<|im_end|>` and whitespace, the
+    same normalization `accuracy_reward` applies, plus whether the response
+    was finished. Groups are keyed by `uid` when the trainer provides it,
+    otherwise by the prompt messages and reference answer.
+
+    Returns (unique_items, {duplicate_row: representative_row}).
+    """
+    unique_items = []
+    duplicates = {}
+    representatives = {}
+    for item in items:
+        i, _, output, _, task, _, _ = item
+        key = (prompt_group(item, uids), task, output.endswith('<|im_end|>'), output.replace('<|im_end|>', '').strip())
+        if key in representatives:
+            duplicates[i] = representatives[key]
+        else:
+            representatives[key] = i
+            unique_items.append(item)
+    return unique_items, duplicates
+
+
+class CompactReward():
+    """Final-token rewards of a batch in (index, value) form.
+
+    `index[i]` is the position of the last valid response token of row i and
+    `value[i]` its reward; every other position of the dense tensor is zero.
+    """
+    def __init__(self, index, value, shape) -> None:
+        self.index = index
+        self.value = value
+        self.shape = shape
+
+    def to_dense(self, device=None):
+        import torch
+        reward_tensor = torch.zeros(self.shape, dtype=torch.float32, device=device)
+        rows = torch.arange(self.shape[0], device=reward_tensor.device)
+        reward_tensor[rows, self.index.to(reward_tensor.device)] = self.value.to(reward_tensor.device)
+        return reward_tensor
+
+
 ###  多线程的处理模式   
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from math_pool import get_math_pool
+from math_match import count_shared, pop_math_stats, remember
+import reward_model_api
+from reward_model_api import AsyncVerifier, configure_endpoints, judge_stats
+from reward_metrics import merge_metrics
+from streaming_rewards import StreamingRewardScorer
+from verifier_scheduler import PrefixAwareScheduler
+from task_scorers import group_by_scorer
+from log_writer import configure_reward_logs, get_reward_log, reward_log_stats
+
+
 class MultiRewardManager():
     """The reward manager.
     """
-    def __init__(self, tokenizer, num_examine) -> None:
+    def __init__(self, 
+                 tokenizer, 
+                 num_examine, 
+                 math_workers=0, 
+                 math_timeout=30.0, 
+                 decode_chunk_size=1024,
+                 verifier_mode='thread',
+                 verifier_max_in_flight=512,
+                 verifier_batch_size=1,
+                 verifier_batch_wait=0.05,
+                 verifier_tokenizer=None,
+                 verifier_urls=None,
+                 verifier_max_connections=256,
+                 verifier_retries=3,
+                 verifier_health_interval=30.0,
+                 verifier_eject_factor=3.0,
+                 verifier_prefix_ordering=True,
+                 verifier_prefix_warmup=0.0,
+                 verifier_prompt_variant='default',
+                 verifier_stop_policy=None,
+                 verifier_hedge_percentile=0.0,
+                 reward_deadline=0.0,
+                 reward_fallback='group_mean',
+                 reward_workers=0,
+                 ray_num_cpus=None,
+                 streaming=False,
+                 verifier_cache_size=0,
+                 verifier_cache_path=None,
+                 dedup_completions=True,
+                 pass_rate_index=None,
+                 log_dir=None,
+                 log_compression=None,
+                 log_max_bytes=0,
+                 log_sample_rate=1.0,
+                 log_queue_size=10000,
+                 log_suffix='') -> None:
         self.tokenizer = tokenizer
         self.num_examine = num_examine  # the number of batches of decoded responses to print to the console
+        self.decode_chunk_size = decode_chunk_size
+        # math_workers > 0 scores math tasks in a persistent process pool instead of sequentially on the driver,
+        # shared with the other managers of the process
+        self.math_pool = get_math_pool(math_workers, timeout=math_timeout) if math_workers > 0 else None
+        # verifier_urls spreads judge requests over several verifier replicas instead of the single `reqUrl`
+        if verifier_urls:
+            configure_endpoints(list(verifier_urls), 
+                                max_connections=verifier_max_connections, 
+                                retries=verifier_retries, 
+                                health_interval=verifier_health_interval, 
+                                eject_factor=verifier_eject_factor,
+                                hedge_percentile=verifier_hedge_percentile)
+        # 'thread' keeps the 128-thread pool, 'async' sends judge requests from one asyncio loop
+        assert verifier_mode in ['thread', 'async'], f"unknown {verifier_mode=}"
+        self.verifier = AsyncVerifier(max_in_flight=verifier_max_in_flight, 
+                                      batch_size=verifier_batch_size, 
+                                      batch_wait=verifier_batch_wait, 
+                                      tokenizer=verifier_tokenizer) if verifier_mode == 'async' else None
+        # 'score_first' asks the judge for the score before the analysis, a stop policy ('boxed', 'score_section')
+        # streams the judge reply and closes it once the score is in
+        set_judge_options(template=verifier_prompt_variant, stop_policy=verifier_stop_policy)
+        # send judge requests grouped by prompt so the judge server's prefix cache gets hits,
+        # followers of a group wait verifier_prefix_warmup seconds after their leader
+        self.scheduler = PrefixAwareScheduler(warmup=verifier_prefix_warmup, 
+                                              tokenizer=self.verifier.tokenizer if self.verifier is not None else None) if verifier_prefix_ordering else None
+        # reward_deadline > 0 bounds the wall time of judge scoring per step, items still unscored then or whose
+        # judge request failed get the reward_fallback score ('zero' or 'group_mean') and are logged to the `deadline_missed` log
+        assert reward_fallback in ['zero', 'group_mean'], f"unknown {reward_fallback=}"
+        # the deadline cancels judge requests and hedging races them, both on the asyncio loop; a blocking
+        # request of the thread pool can't be stopped and would hold its replica slot into the next step
+        assert verifier_mode == 'async' or (reward_deadline <= 0 and verifier_hedge_percentile <= 0), \
+            "reward_deadline and verifier_hedge_percentile need verifier_mode='async'"
+        self.reward_deadline = reward_deadline
+        self.reward_fallback = reward_fallback
+        # indices of the items of the current batch still unscored at the deadline, scorers add to it
+        self.timed_out = set()
+        # reward_workers > 0 (or -1 for all idle CPUs) shards scoring across Ray CPU actors,
+        # the pool is created on the first call, after the trainer has placed its GPU workers
+        self.reward_workers = reward_workers
+        self.ray_num_cpus = ray_num_cpus
+        # everything a scoring actor needs to rebuild this manager without the tokenizer
+        self.worker_kwargs = dict(math_workers=math_workers, 
+                                  math_timeout=math_timeout, 
+                                  verifier_mode=verifier_mode, 
+                                  verifier_max_in_flight=verifier_max_in_flight,
+                                  verifier_batch_size=verifier_batch_size,
+                                  verifier_batch_wait=verifier_batch_wait,
+                                  verifier_tokenizer=verifier_tokenizer,
+                                  verifier_urls=verifier_urls,
+                                  verifier_max_connections=verifier_max_connections,
+                                  verifier_retries=verifier_retries,
+                                  verifier_health_interval=verifier_health_interval,
+                                  verifier_eject_factor=verifier_eject_factor,
+                                  verifier_prefix_ordering=verifier_prefix_ordering,
+                                  verifier_prefix_warmup=verifier_prefix_warmup,
+                                  verifier_prompt_variant=verifier_prompt_variant,
+                                  verifier_stop_policy=verifier_stop_policy,
+                                  verifier_hedge_percentile=verifier_hedge_percentile,
+                                  verifier_cache_size=verifier_cache_size,
+                                  verifier_cache_path=verifier_cache_path,
+                                  log_dir=log_dir,
+                                  log_compression=log_compression,
+                                  log_max_bytes=log_max_bytes,
+                                  log_sample_rate=log_sample_rate,
+                                  log_queue_size=log_queue_size)
+        # reward logs are written by a background thread, see log_writer.py
+        configure_reward_logs(log_dir=log_dir, 
+                              suffix=log_suffix,
+                              compression=log_compression, 
+                              max_bytes=log_max_bytes, 
+                              sample_rate=log_sample_rate, 
+                              queue_size=log_queue_size)
+        # verifier_cache_size > 0 caches judge replies in memory, verifier_cache_path adds a sqlite tier that survives restarts
+        self.verifier_cache = set_verifier_cache(verifier_cache_size, verifier_cache_path) if verifier_cache_size > 0 else None
+        # score identical completions of a prompt group only once
+        self.dedup_completions = dedup_completions
+        # sqlite file recording how every prompt group scored per step, read by `SaturationAwareSampler`;
+        # only for the training reward_fn, validation prompts would pollute it
+        self.pass_rate_index = None
+        if pass_rate_index:
+            from pass_rate_index import PassRateIndex
+            self.pass_rate_index = PassRateIndex(pass_rate_index)
+        # per-step reward stage metrics, collected by the trainer logger through `pop_metrics`
+        self.metrics = defaultdict(float)
+        # streaming=True scores responses handed over by `submit_response` while the rollout is still running
+        self.stream = StreamingRewardScorer(self) if streaming else None
 
-    def process_single_item(self, args):
-        i, data_item = args
-        messages = data_item.non_tensor_batch['messages']
-        task = data_item.non_tensor_batch['data_task']
-        limit = data_item.non_tensor_batch['limits']
-        
-        prompt_ids = data_item.batch['prompts']
-        prompt_length = prompt_ids.shape[-1]
+    def pop_metrics(self):
+        """Return the metrics accumulated since the last call and reset them.
+
+        Besides the counters of `__call__` / `score_items` this collects the
+        judge request statistics, verifier cache lookups, replica pool counters
+        and reward log drops of this process.
+        """
+        metrics, self.metrics = dict(self.metrics), defaultdict(float)
+        merge_metrics(metrics, judge_stats.pop())
+        merge_metrics(metrics, reward_log_stats())
+        merge_metrics(metrics, pop_math_stats())
+        if self.verifier_cache is not None:
+            merge_metrics(metrics, self.verifier_cache.pop_stats())
+        if reward_model_api.endpoint_pool is not None:
+            merge_metrics(metrics, reward_model_api.endpoint_pool.pop_stats())
+        math_items = sum(metrics.get(f'math/tier_{tier}', 0) for tier in ['memo', 'string', 'numeric', 'math_verify'])
+        if math_items:
+            metrics['math/fast_path_rate'] = 1.0 - metrics.get('math/tier_math_verify', 0) / math_items
+        lookups = sum(metrics.get(f'verifier_cache/{key}', 0) for key in ['hits', 'disk_hits', 'misses'])
+        if lookups:
+            metrics['verifier_cache/hit_rate'] = (metrics['verifier_cache/hits'] + metrics['verifier_cache/disk_hits']) / lookups
+        return metrics
 
-        #valid_prompt_length = data_item.batch['attention_mask'][:prompt_length].sum()
-        #valid_prompt_ids = prompt_ids[-valid_prompt_length:]
+    @contextmanager
+    def timer(self, phase):
+        """Add the wall time of the block to the `reward/time/{phase}` metric."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.metrics[f'reward/time/{phase}'] += time.perf_counter() - start
 
-        response_ids = data_item.batch['responses']
-        valid_response_length = data_item.batch['attention_mask'][prompt_length:].sum()
-        valid_response_ids = response_ids[:valid_response_length]
+    def submit_response(self, messages, response_ids, ground_truth, task, limit):
+        """Rollout-side hook: call once per finished sequence (`streaming_rollout.py` does it for async rollout)."""
+        if self.stream is not None:
+            self.stream.submit(messages, response_ids, ground_truth, task, limit)
 
-        response_str = self.tokenizer.decode(valid_response_ids, skip_special_tokens=False)
-        output = response_str.strip()
-        
-        ground_truth = data_item.non_tensor_batch['reward_model']['ground_truth']
+    def decode_batch(self, data: "DataProto"):
+        """Decode every valid response of the batch before any scoring starts.
+
+        Valid lengths come from one reduction over the response part of the
+        attention mask, and the responses are decoded in chunks of
+        `decode_chunk_size` instead of one `tokenizer.decode` call per row.
+        """
+        prompt_length = data.batch['prompts'].shape[-1]
+        valid_response_lengths = data.batch['attention_mask'][:, prompt_length:].sum(dim=-1).tolist()
+        response_ids = data.batch['responses'].cpu()
+
+        outputs = []
+        for start in range(0, len(valid_response_lengths), self.decode_chunk_size):
+            chunk = [response_ids[i, :valid_response_lengths[i]].tolist() 
+                     for i in range(start, min(start + self.decode_chunk_size, len(valid_response_lengths)))]
+            outputs.extend(response_str.strip() for response_str in self._batch_decode(chunk))
+
+        messages = data.non_tensor_batch['messages']
+        tasks = data.non_tensor_batch['data_task']
+        limits = data.non_tensor_batch['limits']
+        reward_model = data.non_tensor_batch['reward_model']
+        return [(i, messages[i], outputs[i], reward_model[i]['ground_truth'], tasks[i], limits[i], valid_response_lengths[i]) 
+                for i in range(len(outputs))]
+
+    def _batch_decode(self, sequences):
+        backend = getattr(self.tokenizer, 'backend_tokenizer', None)
+        if backend is None:
+            return self.tokenizer.batch_decode(sequences, skip_special_tokens=False)
+        # fast tokenizers decode the whole chunk in rust; transformers' batch_decode loops over `decode`
+        texts = backend.decode_batch(sequences, skip_special_tokens=False)
+        if getattr(self.tokenizer, 'clean_up_tokenization_spaces', False):
+            texts = [self.tokenizer.clean_up_tokenization(text) for text in texts]
+        return texts
+
+    def finalize_score(self, score, valid_response_length):
+        """Hook for length-dependent shaping on top of the task reward."""
+        return score
+
+    def process_single_item(self, item):
+        i, messages, output, ground_truth, task, limit, valid_response_length = item
         
         length = valid_response_length
         score = accuracy_reward(messages, output, ground_truth, task, limit, length)
         
-        return (i, score, output, messages, ground_truth, valid_response_length)
+        return (i, score)
+
+    def process_math_items(self, math_items):
+        # string/numeric matches and memoized answers are decided here, only the rest goes to the process pool
+        results, pending, keys = [], [], []
+        for item in math_items:
+            _, _, output, ground_truth, task, limit, _ = item
+            reward, key = fast_accuracy_reward(output, ground_truth, task, limit)
+            if reward is None:
+                pending.append(item)
+                keys.append(key)
+            else:
+                results.append((item[0], reward))
+
+        # items with the same memo key (task, boxed answer, reference) share one math_verify call,
+        # items without a key (no single \boxed{}) are verified on their own
+        groups = {}
+        for item, key in zip(pending, keys):
+            groups.setdefault(key if key is not None else (None, item[0]), []).append(item)
+        count_shared(len(pending) - len(groups))
+        group_keys = [key if key[0] is not None else None for key in groups]
+        scores = self.math_pool.score([(messages, output, ground_truth, task, limit, length) 
+                                       for _, messages, output, ground_truth, task, limit, length in (group[0] for group in groups.values())],
+                                      group_keys)
+        for key, group, (score, verified) in zip(group_keys, groups.values(), scores):
+            # timeouts, the stuck-pool guard and worker errors score 0.0 but are not memoized
+            if verified:
+                remember(key, score)
+            results.extend((item[0], score) for item in group)
+        return results
+
+    async def process_single_item_async(self, item):
+        i, messages, output, ground_truth, task, limit, valid_response_length = item
+        
+        length = valid_response_length
+        score = await async_accuracy_reward(messages, output, ground_truth, task, limit, length, self.verifier)
+        
+        return (i, score)
+
+    def process_judge_item(self, item):
+        if self.scheduler is not None:
+            self.scheduler.wait(item[0])
+        return self.process_single_item(item)
+
+    async def process_judge_item_async(self, item):
+        if self.scheduler is not None:
+            await self.scheduler.async_wait(item[0])
+        return await self.process_single_item_async(item)
+
+    def score_items(self, items, timeout=None):
+        """Score decoded items, returns (i, score) pairs before `finalize_score`.
+
+        With `timeout` (seconds) items not scored by then get score None.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        remaining = lambda: None if deadline is None else max(deadline - time.monotonic(), 0.0)
+        # every task is scored by the batch scorer registered for it, see task_scorers.py
+        groups = group_by_scorer(items)
+        background = [(scorer, task_items) for scorer, task_items in groups if scorer.background]
+        results = []
+        with ThreadPoolExecutor(max_workers=max(len(background), 1), thread_name_prefix='reward-scorer') as executor:
+            # judge requests go out first and wait on the network while math and rules score on this thread
+            futures = [executor.submit(self.run_scorer, scorer, task_items, remaining()) for scorer, task_items in background]
+            for scorer, task_items in groups:
+                if not scorer.background:
+                    results.extend(self.run_scorer(scorer, task_items, remaining()))
+            for future in futures:
+                results.extend(future.result())
+        return results
+
+    def run_scorer(self, scorer, items, timeout=None):
+        with self.timer(scorer.name):
+            return scorer.score(self, items, timeout=timeout)
 
-    def __call__(self, data: DataProto, return_dict=False):
+    def log_fallbacks(self, items, fallbacks):
+        missed = sum(i in self.timed_out for i in fallbacks)
+        failed = len(fallbacks) - missed
+        causes = []
+        if missed:
+            causes.append(f"{missed} items missed the {self.reward_deadline}s reward deadline")
+        if failed:
+            causes.append(f"{failed} items got no judge score")
+        print(f"{type(self).__name__}: {' and '.join(causes)}, scored with reward_fallback='{self.reward_fallback}'")
+        self.metrics['reward/deadline_missed'] += missed
+        self.metrics['reward/judge_failed'] += failed
+        log = get_reward_log('deadline_missed')
+        for i, messages, output, ground_truth, task, _, _ in items:
+            if i in fallbacks:
+                log.write({'question': messages[-1]['content'], 'completion': output, 'solution': ground_truth, 
+                           'task': task, 'cause': 'deadline' if i in self.timed_out else 'judge_failed', 
+                           'fallback': self.reward_fallback, 'reward_score': fallbacks[i]})
+
+    def __call__(self, data: "DataProto", return_dict=False, compact=False):
+        """Score a batch.
+
+        With `compact=True` the reward is returned as a `CompactReward` holding
+        only the final-token positions and values; call `to_dense()` when the
+        full [batch, response_length] tensor is actually needed.
+        """
         # If there is rm score, we directly return rm score. Otherwise, we compute via rm_score_fn
         if "rm_scores" in data.batch.keys():
             if return_dict:
@@ -82,38 +444,70 @@ class MultiRewardManager():
             else:
                 return data.batch["rm_scores"]
         
-        reward_tensor = torch.zeros_like(data.batch['responses'], dtype=torch.float32)
         reward_extra_info = defaultdict(list)
         data_list = []
+        rewards = [0.0] * len(data)
+        valid_response_lengths = [0] * len(data)
         
-        # Separate math and non-math tasks
-        math_args = []
-        other_args = []
-        
-        for i in range(len(data)):
-            data_item = data[i]
-            task = data_item.non_tensor_batch['data_task']
-            if task in ['math', 'MedCalc-Bench']:
-                math_args.append((i, data_item))
+        with self.timer('decode'):
+            items = self.decode_batch(data)
+        duplicates = {}
+        with self.timer('dedup'):
+            if self.dedup_completions:
+                items_to_score, duplicates = dedup_group_items(items, data.non_tensor_batch.get('uid'))
             else:
-                other_args.append((i, data_item))
-        
-        # Process math tasks sequentially
-        math_results = []
-        for args in math_args:
-            math_results.append(self.process_single_item(args))
-        
-        # Process other tasks in parallel
-        other_results = []
-        if other_args:
-            with ThreadPoolExecutor(max_workers=128) as executor:
-                other_results = list(executor.map(self.process_single_item, other_args))
+                items_to_score = items
+        self.metrics['reward/dedup_items'] += len(duplicates)
+
+        deadline = time.monotonic() + self.reward_deadline if self.reward_deadline > 0 else None
+        remaining = lambda: None if deadline is None else max(deadline - time.monotonic(), 0.0)
+
+        raw_scores = {}
+        self.timed_out = set()
+        if self.stream is not None:
+            with self.timer('stream_wait'):
+                streamed, items_to_score = self.stream.take(items_to_score)
+                for item, future in streamed:
+                    try:
+                        raw_scores[item[0]] = future.result(timeout=remaining())
+                    except FutureTimeoutError:
+                        future.cancel()
+                        self.timed_out.add(item[0])
+                        raw_scores[item[0]] = None
+                    except Exception:
+                        # past the deadline, cancelled or failed: scored by reward_fallback
+                        future.cancel()
+                        raw_scores[item[0]] = None
+            self.metrics['reward/streamed_items'] += len(streamed)
+
+        with self.timer('score'):
+            if self.reward_workers:
+                # ray is only imported when scoring is sharded across actors
+                from reward_workers import get_worker_pool
+                worker_pool = get_worker_pool(type(self), self.worker_kwargs, self.reward_workers, self.ray_num_cpus)
+                worker_scores, worker_timed_out, worker_metrics = worker_pool.score(items_to_score, timeout=remaining())
+                raw_scores.update(worker_scores)
+                self.timed_out.update(worker_timed_out)
+                self.metrics = merge_metrics(self.metrics, worker_metrics)
+            else:
+                raw_scores.update(self.score_items(items_to_score, timeout=remaining()))
         
-        # Combine all results
-        all_results = math_results + other_results
+        # fan the score of each unique completion back out to its duplicates
+        for duplicate, representative in duplicates.items():
+            raw_scores[duplicate] = raw_scores[representative]
+            if representative in self.timed_out:
+                self.timed_out.add(duplicate)
+
+        fallbacks = fallback_scores(items, raw_scores, self.reward_fallback, data.non_tensor_batch.get('uid'))
+        if fallbacks:
+            self.log_fallbacks(items, fallbacks)
+            raw_scores.update(fallbacks)
         
-        for res in all_results:
-            i, score, output, messages, ground_truth, valid_response_length = res
+        finalize_start = time.perf_counter()
+        task_rewards = defaultdict(list)
+        for item in items:
+            i, messages, output, ground_truth, task, _, valid_response_length = item
+            score = self.finalize_score(raw_scores[i], valid_response_length)
             
             data_list.append({
                 'question': messages[-1]['content'],
@@ -131,15 +525,31 @@ class MultiRewardManager():
             else:
                 reward = score
             
-            reward_tensor[i, valid_response_length - 1] = reward
+            rewards[i] = reward
+            valid_response_lengths[i] = valid_response_length
+            task_rewards[task].append(reward)
 
-        try:
-            process_data = process_questions(data_list)
-            with open(f'/workspace/LLM-Train/LLM-RL/LLM-veRL/log_date/{strtime}-log_train.json', 'a+', encoding='utf-8') as target_file:
-                for item in process_data:
-                    target_file.write(json.dumps(item, ensure_ascii=False) + '\n')
-        except:
-            pass
+        import torch
+        responses = data.batch['responses']
+        reward_tensor = CompactReward(index=torch.tensor(valid_response_lengths, dtype=torch.long) - 1,
+                                      value=torch.tensor(rewards, dtype=torch.float32),
+                                      shape=tuple(responses.shape))
+        if not compact:
+            reward_tensor = reward_tensor.to_dense(device=responses.device)
+        self.metrics['reward/time/finalize'] += time.perf_counter() - finalize_start
+
+        if self.pass_rate_index is not None and 'index' in data.non_tensor_batch:
+            with self.timer('pass_rate'):
+                num_groups, num_saturated = self.pass_rate_index.update(data.non_tensor_batch['index'], rewards)
+            self.metrics['reward/prompt_groups'] += num_groups
+            self.metrics['reward/saturated_groups'] += num_saturated
+
+        with self.timer('log'):
+            get_reward_log('log_train').write_many(process_questions(data_list))
+
+        for task, values in task_rewards.items():
+            self.metrics[f'reward/count/{task}'] += len(values)
+            self.metrics[f'reward/score/{task}'] = sum(values) / len(values)
         
         if return_dict:
             return {
@@ -150,46 +560,24 @@ class MultiRewardManager():
             return reward_tensor
     
 
-class DAPORewardManager():
+class DAPORewardManager(MultiRewardManager):
     """The reward manager.
     """
     def __init__(self, 
                  tokenizer, 
                  num_examine,
                  max_resp_len=None,
-                 overlong_buffer_cfg=None) -> None:
-        self.tokenizer = tokenizer
-        self.num_examine = num_examine  # the number of batches of decoded responses to print to the console
+                 overlong_buffer_cfg=None,
+                 **kwargs) -> None:
+        super().__init__(tokenizer, num_examine, **kwargs)
         self.overlong_buffer_cfg = overlong_buffer_cfg
         self.max_resp_len = max_resp_len
+        self.worker_kwargs.update(max_resp_len=max_resp_len, overlong_buffer_cfg=overlong_buffer_cfg)
         
         if self.overlong_buffer_cfg is not None:
             assert self.max_resp_len is not None, f"max_resp_len must be provided if {overlong_buffer_cfg=}, but got None"
 
-    def process_single_item(self, args):
-        i, data_item = args
-        messages = data_item.non_tensor_batch['messages']
-        task = data_item.non_tensor_batch['data_task']
-        limit = data_item.non_tensor_batch['limits']
-        
-        prompt_ids = data_item.batch['prompts']
-        prompt_length = prompt_ids.shape[-1]
-
-        #valid_prompt_length = data_item.batch['attention_mask'][:prompt_length].sum()
-        #valid_prompt_ids = prompt_ids[-valid_prompt_length:]
-
-        response_ids = data_item.batch['responses']
-        valid_response_length = data_item.batch['attention_mask'][prompt_length:].sum()
-        valid_response_ids = response_ids[:valid_response_length]
-
-        response_str = self.tokenizer.decode(valid_response_ids, skip_special_tokens=False)
-        output = response_str.strip()
-        
-        ground_truth = data_item.non_tensor_batch['reward_model']['ground_truth']
-        
-        length = valid_response_length
-        score = accuracy_reward(messages, output, ground_truth, task, limit, length)
-        
+    def finalize_score(self, score, valid_response_length):
         if self.overlong_buffer_cfg.enable:
             overlong_buffer_len = self.overlong_buffer_cfg.len
             expected_len = self.max_resp_len - overlong_buffer_len
@@ -197,82 +585,4 @@ class DAPORewardManager():
             overlong_penalty_factor = self.overlong_buffer_cfg.penalty_factor
             overlong_reward = min(-exceed_len / overlong_buffer_len * overlong_penalty_factor, 0)
             score += overlong_reward
-        
-        return (i, score, output, messages, ground_truth, valid_response_length)
-
-    def __call__(self, data: DataProto, return_dict=False):
-        # If there is rm score, we directly return rm score. Otherwise, we compute via rm_score_fn
-        if "rm_scores" in data.batch.keys():
-            if return_dict:
-                return {"reward_tensor": data.batch["rm_scores"]}
-            else:
-                return data.batch["rm_scores"]
-            
-        reward_tensor = torch.zeros_like(data.batch['responses'], dtype=torch.float32)
-        reward_extra_info = defaultdict(list)
-        data_list = []
-        
-        # Separate math and non-math tasks
-        math_args = []
-        other_args = []
-        
-        for i in range(len(data)):
-            data_item = data[i]
-            task = data_item.non_tensor_batch['data_task']
-            if task in ['math', 'MedCalc-Bench']:
-                math_args.append((i, data_item))
-            else:
-                other_args.append((i, data_item))
-        
-        # Process math tasks sequentially
-        math_results = []
-        for args in math_args:
-            math_results.append(self.process_single_item(args))
-        
-        # Process other tasks in parallel
-        other_results = []
-        if other_args:
-            with ThreadPoolExecutor(max_workers=128) as executor:
-                other_results = list(executor.map(self.process_single_item, other_args))
-        
-        # Combine all results
-        all_results = math_results + other_results
-        
-        for res in all_results:
-            i, score, output, messages, ground_truth, valid_response_length = res
-            
-            data_list.append({
-                'question': messages[-1]['content'],
-                'completion': output,
-                'solution': ground_truth,
-                'reward_score': score
-            })
-            
-            if isinstance(score, dict):
-                reward = score["score"]
-                # Store the information including original reward
-                for key, value in score.items():
-                    reward_extra_info[key].append(value)
-            else:
-                reward = score
-            
-            reward_tensor[i, valid_response_length - 1] = reward
-
-        try:
-            process_data = process_questions(data_list)
-            with open(f'/workspace/LLM-Train/LLM-RL/LLM-veRL/log_date/{strtime}-log_train.json', 'a+', encoding='utf-8') as target_file:
-                for item in process_data:
-                    target_file.write(json.dumps(item, ensure_ascii=False) + '\n')
-        except:
-            pass
-
-        if return_dict:
-            return {
-                "reward_tensor": reward_tensor,
-                "reward_extra_info": reward_extra_info,
-            }
-        else:
-            return reward_tensor
-    
-
-
+        return score
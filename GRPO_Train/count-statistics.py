@@ -1,6 +1,7 @@
 import json
 from collections import defaultdict
 import time
+from log_writer import open_log
 strtime = time.strftime("%Y%m%d")
 
 # 基础参数
@@ -11,7 +12,7 @@ num_gen = 8
 
 # 数据加载
 input_dir = '/workspace/AAA-LLM-RL/LLM-veRL/log_date/20250513-log_train.json'
-with open(input_dir, 'r', encoding='utf-8') as f:
+with open_log(input_dir) as f:
     lists = [json.loads(line) for line in f]
 train_result = [item for item in lists if len(item['reward_score']) > 1]
 
@@ -0,0 +1,88 @@
+"""Sampler that batches prompts of similar length.
+
+With a random sampler one long multi-turn prompt lands next to short `choice`
+prompts, and the rollout and the token-budgeted micro-batches of the step are
+sized by it. `LengthBucketSampler` sorts the dataset by prompt length once into
+buckets of `bucket_batches` batches, shuffles within the buckets every epoch,
+cuts them into batches of the dataloader's batch size and shuffles the batch
+order. Every row is still seen once per epoch, only the grouping into steps
+changes. The rows that do not fill a batch (dropped by the trainer's
+`drop_last` dataloader) are drawn at random every epoch and always come last.
+"""
+import json
+
+import torch
+from torch.utils.data import Sampler
+
+from pass_rate_index import SamplerIterator
+
+
+def prompt_lengths(dataset, prompt_key='prompt'):
+    """Prompt length of every row: the `prompt_length` column written by data_preprocess.py, else characters of the prompt."""
+    if hasattr(dataset, 'prompt_lengths'):
+        return dataset.prompt_lengths()
+    dataframe = getattr(dataset, 'dataframe', None)
+    if dataframe is None:
+        raise ValueError(f"{type(dataset).__name__} has no dataframe to read prompt lengths from")
+    if 'prompt_length' in dataframe.column_names:
+        return list(dataframe['prompt_length'])
+    return [len(json.dumps(prompt, ensure_ascii=False)) for prompt in dataframe[prompt_key]]
+
+
+class LengthBucketSampler(Sampler):
+    def __init__(self, dataset, batch_size, seed=1, bucket_batches=4, lengths=None, prompt_key='prompt') -> None:
+        self.batch_size = batch_size
+        self.seed = seed
+        lengths = prompt_lengths(dataset, prompt_key) if lengths is None else list(lengths)
+        self.num_rows = len(lengths)
+        self.bucket_rows = batch_size * bucket_batches
+        self.rank = [0] * self.num_rows
+        for rank, row in enumerate(sorted(range(self.num_rows), key=lambda row: lengths[row])):
+            self.rank[row] = rank
+        self.epoch = 0
+        self.order = None
+        self.yielded = 0
+
+    def __len__(self):
+        return self.num_rows
+
+    def epoch_order(self, epoch):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed * 100003 + epoch)
+        permutation = torch.randperm(self.num_rows, generator=generator).tolist()
+        # rows that do not fill a batch are random ones, as with a random sampler, and go last
+        num_tail = self.num_rows % self.batch_size
+        tail, rows = permutation[:num_tail], sorted(permutation[num_tail:], key=lambda row: self.rank[row])
+        position = {row: k for k, row in enumerate(permutation)}
+        batches = []
+        for start in range(0, len(rows), self.bucket_rows):
+            bucket = sorted(rows[start:start + self.bucket_rows], key=position.get)
+            batches.extend(bucket[k:k + self.batch_size] for k in range(0, len(bucket), self.batch_size))
+        batches = [batches[k] for k in torch.randperm(len(batches), generator=generator).tolist()]
+        return [row for batch in batches for row in batch] + tail
+
+    def __iter__(self):
+        # a finished epoch moves on to the next, an epoch restored by `load_state_dict` continues
+        if self.yielded >= self.num_rows:
+            self.epoch += 1
+            self.yielded = 0
+            self.order = None
+        return SamplerIterator(self)
+
+    def next_row(self):
+        if self.yielded >= self.num_rows:
+            raise StopIteration
+        if self.order is None:
+            self.order = self.epoch_order(self.epoch)
+        row = self.order[self.yielded]
+        self.yielded += 1
+        return row
+
+    def state_dict(self):
+        # the order is a function of (seed, epoch), no need to store it
+        return {'epoch': self.epoch, 'yielded': self.yielded}
+
+    def load_state_dict(self, state_dict):
+        self.epoch = state_dict['epoch']
+        self.yielded = state_dict['yielded']
+        self.order = None
@@ -0,0 +1,188 @@
+"""Background writer for the reward logs (`*-log_train.json`, `*-model_verifier.json`).
+
+Records are put on a bounded queue and written by one daemon thread in
+batches, so the reward hot path never opens files or contends on a file lock.
+The file stays open between batches, can be gzip/zstd compressed and is
+rotated once it exceeds `max_bytes`. When the queue is full, records are
+dropped and counted instead of blocking scoring. Write errors are reported.
+"""
+import atexit
+import gzip
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def open_log(path):
+    """Open a (possibly compressed) reward log for reading, line by line."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError("reading .zst reward logs requires the zstandard package")
+        import io
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True), encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+class RewardLogWriter():
+    def __init__(self,
+                 path,
+                 compression=None,
+                 max_bytes=0,
+                 sample_rate=1.0,
+                 queue_size=10000,
+                 batch_size=256,
+                 flush_interval=1.0) -> None:
+        assert compression in _SUFFIXES, f"unknown {compression=}, expected one of {list(_SUFFIXES)}"
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError("log_compression='zstd' requires the zstandard package")
+        self.base_path = path
+        self.path = path + _SUFFIXES[compression]
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.errors = 0
+        self.written = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._raw = None
+        self._stream = None
+        self._thread = threading.Thread(target=self._run, name="reward-log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, record):
+        """Queue one JSON-serializable record; never blocks."""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    record = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if record is None:
+                    self._write_batch(batch)
+                    self._close_file()
+                    return
+                batch.append(record)
+            if batch:
+                self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        if not batch:
+            return
+        try:
+            data = ''.join(json.dumps(record, ensure_ascii=False, default=str) + '\n' for record in batch).encode('utf-8')
+            stream = self._open_file()
+            stream.write(data)
+            stream.flush()
+            self.written += len(batch)
+            if self.max_bytes and self._raw.tell() >= self.max_bytes:
+                self._rotate()
+        except Exception as e:
+            self.errors += 1
+            if self.errors == 1 or self.errors % 100 == 0:
+                print(f"RewardLogWriter: failed to write {self.path} ({self.errors} errors so far): {e!r}")
+
+    def _open_file(self):
+        if self._stream is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._raw = open(self.path, 'ab')
+            if self.compression == 'gzip':
+                # every open appends a new gzip member; multi-member files read back as one stream
+                self._stream = gzip.GzipFile(fileobj=self._raw, mode='ab')
+            elif self.compression == 'zstd':
+                self._stream = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+            else:
+                self._stream = self._raw
+        return self._stream
+
+    def _close_file(self):
+        if self._stream is not None:
+            if self._stream is not self._raw:
+                self._stream.close()
+            self._raw.close()
+            self._stream = self._raw = None
+
+    def _rotate(self):
+        self._close_file()
+        # xxx.json.gz -> xxx.json.1.gz, so rotated files keep their compression suffix
+        index = 1
+        while os.path.exists(f'{self.base_path}.{index}{_SUFFIXES[self.compression]}'):
+            index += 1
+        os.rename(self.path, f'{self.base_path}.{index}{_SUFFIXES[self.compression]}')
+
+
+LOG_DIR = '/workspace/LLM-Train/LLM-RL/LLM-veRL/log_date'
+strtime = time.strftime("%Y%m%d")
+
+# every record of these logs is kept, whatever log_sample_rate is: each fallback score must be accounted for
+UNSAMPLED_LOGS = {'deadline_missed'}
+
+_log_options = {}
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def configure_reward_logs(log_dir=None, suffix='', **options):
+    """Set the options of the reward log writers created afterwards in this process."""
+    _log_options.update(options, log_dir=log_dir or LOG_DIR, suffix=suffix)
+
+
+def get_reward_log(name):
+    """Process-wide writer for `{log_dir}/{date}-{name}.json`, e.g. name='log_train' or 'model_verifier'."""
+    with _writers_lock:
+        if name not in _writers:
+            options = dict(_log_options)
+            log_dir = options.pop('log_dir', LOG_DIR)
+            suffix = options.pop('suffix', '')
+            if name in UNSAMPLED_LOGS:
+                options['sample_rate'] = 1.0
+            _writers[name] = RewardLogWriter(os.path.join(log_dir, f'{strtime}-{name}{suffix}.json'), **options)
+        return _writers[name]
+
+
+def reward_log_stats():
+    """Records dropped (queue full) and write errors of all reward logs of this process so far."""
+    with _writers_lock:
+        writers = list(_writers.values())
+    return {
+        'reward_log/dropped': sum(writer.dropped for writer in writers),
+        'reward_log/errors': sum(writer.errors for writer in writers),
+    }
+
+
+@atexit.register
+def _close_reward_logs():
+    for writer in _writers.values():
+        writer.close()
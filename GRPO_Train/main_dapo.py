@@ -2,6 +2,8 @@
 Note that we don't combine the main with ray_trainer as ray_trainer is used by other main.
 """
 from RewardManager import DAPORewardManager
+from reward_metrics import attach_reward_metrics
+from streaming_rewards import attach_streaming_rollout
 from verl.trainer.ppo.ray_trainer import RayPPOTrainer
 import ray
 from omegaconf import OmegaConf
@@ -103,28 +105,48 @@ class TaskRunner:
             role_worker_mapping[Role.RefPolicy] = ray.remote(ActorRolloutRefWorker)
             mapping[Role.RefPolicy] = global_pool_id
 
+        # reward_kwargs carries the reward manager options (math_workers, ...); the overlong settings come from the dapo config
+        reward_kwargs = {**config.reward_model.get("reward_kwargs", {}),
+                         "ray_num_cpus": config.ray_init.num_cpus,
+                         "max_resp_len": config.data.max_response_length,
+                         "overlong_buffer_cfg": config.reward_model.overlong_buffer}
         reward_fn = DAPORewardManager(tokenizer=tokenizer, 
                                     num_examine=0, 
-                                    max_resp_len=config.data.max_response_length,
-                                    overlong_buffer_cfg=config.reward_model.overlong_buffer)
+                                    pass_rate_index=config.data.get("pass_rate_index", None),
+                                    **reward_kwargs)
         #Note that we always use function-based RM for validation
         val_reward_fn = DAPORewardManager(tokenizer=tokenizer, 
                                         num_examine=1, 
-                                        max_resp_len=config.data.max_response_length,
-                                        overlong_buffer_cfg=config.reward_model.overlong_buffer
+                                        **reward_kwargs
                                         )
 
         resource_pool_manager = ResourcePoolManager(resource_pool_spec=resource_pool_spec, mapping=mapping)
 
+        # the saturation-aware and length-bucket samplers need the dataset, otherwise the trainer builds dataset and sampler itself
+        train_kwargs = {}
+        if config.data.get("skip_saturated", False) or config.data.get("length_bucket_sampler", False):
+            from main_grpo import create_rl_dataset, create_rl_sampler
+            from verl.utils.dataset.rl_dataset import collate_fn
+
+            train_dataset = create_rl_dataset(config.data.train_files, config.data, tokenizer, None)
+            train_kwargs = dict(train_dataset=train_dataset, 
+                                collate_fn=collate_fn, 
+                                train_sampler=create_rl_sampler(config.data, train_dataset))
+
         trainer = RayPPOTrainer(config=config,
                                 tokenizer=tokenizer,
                                 role_worker_mapping=role_worker_mapping,
                                 resource_pool_manager=resource_pool_manager,
                                 ray_worker_group_cls=ray_worker_group_cls,
                                 reward_fn=reward_fn,
-                                val_reward_fn=val_reward_fn)
+                                val_reward_fn=val_reward_fn,
+                                **train_kwargs)
+        # streaming=true: the async rollout callback scores responses of the train prompts as they finish
+        attach_streaming_rollout(reward_fn, config, trainer.train_dataset)
         
         trainer.init_workers()
+        # log the reward stage metrics (dedup savings, ...) next to the trainer metrics, validation ones under val/
+        attach_reward_metrics(trainer)
         trainer.fit()
 
 
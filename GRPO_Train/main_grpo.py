@@ -2,6 +2,8 @@
 Note that we don't combine the main with ray_trainer as ray_trainer is used by other main.
 """
 from RewardManager import MultiRewardManager
+from reward_metrics import attach_reward_metrics
+from streaming_rewards import attach_streaming_rollout
 from verl.trainer.ppo.ray_trainer import RayPPOTrainer
 import ray
 import hydra
@@ -131,8 +133,11 @@ class TaskRunner:
         # reward_fn = RewardManager(tokenizer=tokenizer, num_examine=0)
         # val_reward_fn = RewardManager(tokenizer=tokenizer, num_examine=1)
     
-        reward_fn = MultiRewardManager(tokenizer=tokenizer, num_examine=0, **config.reward_model.get("reward_kwargs", {}))
-        val_reward_fn = MultiRewardManager(tokenizer=tokenizer, num_examine=1, **config.reward_model.get("reward_kwargs", {}))
+        # `ray_init.num_cpus` caps the Ray reward scoring pool when reward_workers=-1
+        reward_kwargs = {**config.reward_model.get("reward_kwargs", {}), "ray_num_cpus": config.ray_init.num_cpus}
+        # `data.pass_rate_index` records per-prompt outcomes of the training steps for the saturation-aware sampler
+        reward_fn = MultiRewardManager(tokenizer=tokenizer, num_examine=0, pass_rate_index=config.data.get("pass_rate_index", None), **reward_kwargs)
+        val_reward_fn = MultiRewardManager(tokenizer=tokenizer, num_examine=1, **reward_kwargs)
 
         resource_pool_manager = ResourcePoolManager(resource_pool_spec=resource_pool_spec, mapping=mapping)
         
@@ -140,7 +145,6 @@ class TaskRunner:
         train_dataset = create_rl_dataset(config.data.train_files, config.data, tokenizer, processor)
         val_dataset = create_rl_dataset(config.data.val_files, config.data, tokenizer, processor)
         train_sampler = create_rl_sampler(config.data, train_dataset)
-        train_sampler = create_rl_sampler(config.data, train_dataset)
         
         from verl.utils.dataset.rl_dataset import collate_fn
         # Initialize the PPO trainer.
@@ -159,8 +163,12 @@ class TaskRunner:
             train_sampler=train_sampler,
             device_name=config.trainer.device,
         )
+        # streaming=true: the async rollout callback scores responses of the train prompts as they finish
+        attach_streaming_rollout(reward_fn, config, trainer.train_dataset)
     
         trainer.init_workers()
+        # log the reward stage metrics (dedup savings, ...) next to the trainer metrics, validation ones under val/
+        attach_reward_metrics(trainer)
         trainer.fit()
 
 
@@ -220,6 +228,30 @@ def create_rl_sampler(data_config, dataset):
     import torch
     from torch.utils.data import RandomSampler, SequentialSampler
 
+    # Batch prompts of similar length together, every prompt is still seen once per epoch.
+    if data_config.get("length_bucket_sampler", False):
+        from length_bucket_sampler import LengthBucketSampler
+
+        assert not data_config.get("skip_saturated", False), "data.length_bucket_sampler and data.skip_saturated are exclusive"
+        return LengthBucketSampler(dataset,
+                                   batch_size=data_config.get("gen_batch_size", data_config.train_batch_size),
+                                   seed=data_config.get("seed", 1),
+                                   bucket_batches=data_config.get("length_bucket_batches", 4),
+                                   prompt_key=data_config.get("prompt_key", "prompt"))
+
+    # Skip prompts whose rollouts all got the same reward in recent steps (zero advantage),
+    # as recorded in `data.pass_rate_index` by the training reward manager.
+    if data_config.get("skip_saturated", False):
+        from pass_rate_index import SaturationAwareSampler
+
+        assert data_config.get("pass_rate_index", None), "data.skip_saturated needs data.pass_rate_index"
+        return SaturationAwareSampler(dataset,
+                                      index_path=data_config.pass_rate_index,
+                                      seed=data_config.get("seed", 1),
+                                      min_streak=data_config.get("saturated_min_streak", 2),
+                                      reprobe_steps=data_config.get("saturated_reprobe_steps", 100),
+                                      keep_prob=data_config.get("saturated_keep_prob", 0.0))
+
     # Use a sampler to facilitate checkpoint resumption.
     # If shuffling is enabled in the data configuration, create a random sampler.
     if data_config.shuffle:
@@ -0,0 +1,152 @@
+"""Cheap answer matching for math tasks before falling back to math_verify.
+
+`parse` / `verify` are sympy-backed and cost milliseconds per item even when
+the final boxed answer is literally the reference. The fast tiers only decide
+what math_verify provably decides the same way: the response has exactly one
+\\boxed{} (several are parsed as a set) and both sides are plain numbers.
+`fast_match` tries, in order:
+
+1. memo: the math_verify result of an earlier item with the same (answer, reference)
+2. string: the boxed answer is the same number string as the reference
+3. numeric: both sides are integers, decimals or \\frac{a}{b} / a/b fractions;
+   equal values match, different integers do not (anything else, e.g. "3." or
+   "+3", is left to math_verify)
+
+Only what these tiers cannot decide goes through math_verify, and its result is
+memoized with `remember`. `pop_math_stats` reports how often each tier decided.
+tests/test_math_match.py checks the tiers against math_verify.
+"""
+import re
+from collections import Counter, OrderedDict
+from fractions import Fraction
+from functools import lru_cache
+
+MEMO_SIZE = 100000
+
+math_stats = Counter()
+_memo = OrderedDict()
+
+# math_verify does not extract \fbox{}, so only \boxed{} answers are matched here
+_BOXED_PREFIX = '\\boxed{'
+# no leading '+' and no trailing '.': math_verify rejects "+3" and "3." against "3"
+_NUMBER_PATTERN = re.compile(r'^-?\d+(\.\d+)?$')
+_FRACTION_PATTERN = re.compile(r'^(-?)(?:\\frac\{(-?\d+)\}\{(\d+)\}|(\d+)/(\d+))$')
+
+
+def last_boxed(text):
+    """Content of the last \\boxed{...} (nested braces allowed), None if there is none."""
+    start = text.rfind(_BOXED_PREFIX)
+    if start < 0:
+        return None
+    start += len(_BOXED_PREFIX)
+    depth = 1
+    for end in range(start, len(text)):
+        if text[end] == '{':
+            depth += 1
+        elif text[end] == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:end]
+    return None
+
+
+def single_boxed(text):
+    """Content of the only \\boxed{...} of `text`, None if it has none or several."""
+    if text.count(_BOXED_PREFIX) != 1:
+        return None
+    return last_boxed(text)
+
+
+def normalize_answer(text):
+    # only rewrites math_verify reads the same way; anything else stays and is not a plain number
+    text = text.strip()
+    return text.replace('\\dfrac', '\\frac').replace('\\tfrac', '\\frac')
+
+
+def to_number(text):
+    """Fraction value of an integer, decimal or simple fraction, None for anything else."""
+    if _NUMBER_PATTERN.match(text):
+        return Fraction(text)
+    match = _FRACTION_PATTERN.match(text)
+    if match is None:
+        return None
+    sign, numerator, denominator = match.group(1), match.group(2) or match.group(4), match.group(3) or match.group(5)
+    if int(denominator) == 0:
+        return None
+    value = Fraction(int(numerator), int(denominator))
+    return -value if sign == '-' else value
+
+
+@lru_cache(maxsize=4096)
+def normalized_reference(target):
+    """(normalized reference answer, its value) — the same for every rollout of a prompt."""
+    reference = single_boxed(target) if _BOXED_PREFIX in target else target
+    if reference is None:
+        return None, None
+    reference = normalize_answer(reference)
+    return reference, to_number(reference)
+
+
+def _decided(tier, reward, key):
+    math_stats[f'math/tier_{tier}'] += 1
+    return reward, key
+
+
+def fast_match(output, target, task, limit=None):
+    """Returns (reward, key): reward is None when math_verify has to decide, key memoizes its result."""
+    answer = single_boxed(output)
+    if answer is None:
+        math_stats['math/tier_math_verify'] += 1
+        return None, None
+    answer = normalize_answer(answer)
+    key = (task, answer, target if task == 'math' or limit is None else tuple(limit))
+    if key in _memo:
+        _memo.move_to_end(key)
+        return _decided('memo', _memo[key], key)
+
+    value = to_number(answer)
+    if task == 'MedCalc-Bench':
+        if value is not None:
+            try:
+                return _decided('numeric', float(limit[0] <= value <= limit[1]), key)
+            except TypeError:
+                pass
+    else:
+        reference, reference_value = normalized_reference(target)
+        if value is not None and reference_value is not None:
+            if answer == reference:
+                return _decided('string', 1.0, key)
+            if value == reference_value:
+                return _decided('numeric', 1.0, key)
+            if value.denominator == 1 and reference_value.denominator == 1:
+                return _decided('numeric', 0.0, key)
+
+    math_stats['math/tier_math_verify'] += 1
+    return None, key
+
+
+def is_memoized(key):
+    return key is not None and key in _memo
+
+
+def remember(key, reward):
+    """Memoize a result math_verify returned; never a timeout or an error score."""
+    if key is None:
+        return
+    _memo[key] = reward
+    _memo.move_to_end(key)
+    while len(_memo) > MEMO_SIZE:
+        _memo.popitem(last=False)
+
+
+def count_shared(count):
+    """`count` items were answered by the math_verify call of an identical item of the same batch."""
+    math_stats['math/tier_math_verify'] -= count
+    math_stats['math/tier_memo'] += count
+
+
+def pop_math_stats():
+    """Tier counts since the last call."""
+    stats = dict(math_stats)
+    math_stats.clear()
+    return stats
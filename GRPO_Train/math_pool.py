@@ -0,0 +1,118 @@
+"""Persistent process pool for math_verify based scoring.
+
+`math_verify` implements its own timeouts with `signal.alarm`, which only works
+in the main thread, so math tasks cannot share the judge thread pool. The pool
+below keeps a fixed set of worker processes alive across training steps; every
+worker scores items in its own main thread, where math_verify behaves exactly as
+it does on the driver.
+"""
+import multiprocessing
+import signal
+import time
+
+from math_match import is_memoized
+from rewards import accuracy_reward
+
+
+class MathVerifyTimeout(BaseException):
+    """Raised inside a worker when an item exceeds its CPU-time budget.
+
+    Derives from BaseException so the `except Exception` in `accuracy_reward`
+    does not swallow it and the timeout can be counted.
+    """
+
+
+def _on_cpu_timeout(signum, frame):
+    raise MathVerifyTimeout()
+
+
+def _init_worker():
+    # SIGPROF/ITIMER_PROF is independent from the SIGALRM timer used by math_verify
+    signal.signal(signal.SIGPROF, _on_cpu_timeout)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # workers only score math items: import math_verify (and sympy) before the first item's CPU budget starts
+    import math_verify  # noqa: F401
+
+
+def _score_item(args):
+    timeout, item, key = args
+    signal.setitimer(signal.ITIMER_PROF, timeout)
+    try:
+        score = accuracy_reward(*item)
+        # math_reward / medcalc_reward memoize only what math_verify returned, not a swallowed exception
+        return score, False, is_memoized(key)
+    except MathVerifyTimeout:
+        return 0.0, True, False
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+
+
+class MathVerifyPool():
+    """Scores `accuracy_reward` argument tuples in a pool of worker processes.
+
+    Each item gets a hard CPU-time budget of `timeout` seconds inside its worker.
+    A wall-clock guard on the driver additionally catches workers that hang
+    outside the interpreter; in that case the pool is torn down and rebuilt on
+    the next call. Items that time out score 0.0, like a failed verification.
+    """
+    def __init__(self, num_workers, timeout=30.0, start_method="spawn") -> None:
+        self.num_workers = num_workers
+        self.timeout = timeout
+        self._ctx = multiprocessing.get_context(start_method)
+        self._pool = None
+        self.num_timeouts = 0
+
+    def _get_pool(self):
+        # created once and reused across steps; spawning workers costs far more than scoring a batch
+        if self._pool is None:
+            self._pool = self._ctx.Pool(self.num_workers, initializer=_init_worker)
+        return self._pool
+
+    def score(self, items, keys=None):
+        """Return (score, verified) of `items` in order.
+
+        `keys` are the `fast_match` memo keys of the items; verified is True when
+        math_verify itself returned the score, so it may be `remember`ed.
+        """
+        if not items:
+            return []
+
+        pool = self._get_pool()
+        keys = keys or [None] * len(items)
+        pending = [pool.apply_async(_score_item, ((self.timeout, item, key),)) for item, key in zip(items, keys)]
+
+        # one extra wave of slack, so a single stuck worker does not fail the whole batch
+        waves = -(-len(items) // self.num_workers)
+        deadline = time.monotonic() + self.timeout * (waves + 1)
+
+        scores = []
+        stuck = False
+        for result in pending:
+            try:
+                score, timed_out, verified = result.get(timeout=max(0.0, deadline - time.monotonic()))
+            except multiprocessing.TimeoutError:
+                score, timed_out, verified, stuck = 0.0, True, False, True
+            except Exception:
+                score, timed_out, verified = 0.0, False, False
+            self.num_timeouts += timed_out
+            scores.append((score, verified))
+
+        if stuck:
+            self.close()
+        return scores
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+# train and validation managers of a process share one pool of worker processes
+_math_pools = {}
+
+
+def get_math_pool(num_workers, timeout=30.0):
+    if (num_workers, timeout) not in _math_pools:
+        _math_pools[(num_workers, timeout)] = MathVerifyPool(num_workers, timeout=timeout)
+    return _math_pools[(num_workers, timeout)]
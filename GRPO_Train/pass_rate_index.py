@@ -0,0 +1,181 @@
+"""Per-prompt rollout outcomes across steps, and a sampler that skips saturated prompts.
+
+A prompt whose rollouts all get the same reward (all solved or all failed) has
+zero advantage under GRPO, and DAPO `filter_groups` drops it only after its
+rollouts were generated. `PassRateIndex` records, for every dataset `index`
+(`extra_info.index`), how its groups scored in each training step in a sqlite
+file shared by the reward manager (writer) and the sampler (reader):
+
+- `rollouts` / `passes`: rollouts seen and rollouts with reward > 0
+- `last_mean`: mean reward of the latest group
+- `streak`: consecutive steps in which the group was saturated
+- `last_step`: step of the latest update, a counter kept in the file
+
+`SaturationAwareSampler` leaves out prompts saturated for `min_streak` steps in
+a row until their record is `reprobe_steps` old, so they are re-checked once in
+a while as the policy changes.
+"""
+import sqlite3
+import threading
+from collections import defaultdict
+
+import torch
+from torch.utils.data import Sampler
+
+
+class PassRateIndex():
+    def __init__(self, path, tolerance=1e-6) -> None:
+        self.path = path
+        # groups whose rewards differ by no more than this are saturated
+        self.tolerance = tolerance
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS prompt_outcomes ("
+                         "idx INTEGER PRIMARY KEY, rollouts INTEGER, passes INTEGER, "
+                         "last_mean REAL, streak INTEGER, last_step INTEGER)")
+        self._db.commit()
+        self.step = self.current_step()
+
+    def current_step(self):
+        row = self._db.execute("SELECT MAX(last_step) FROM prompt_outcomes").fetchone()
+        return row[0] or 0
+
+    def update(self, indices, rewards):
+        """Record one training step: `indices[i]` is the dataset index of row i, `rewards[i]` its reward.
+
+        Returns the number of prompt groups of the step and how many of them were saturated.
+        """
+        groups = defaultdict(list)
+        for index, reward in zip(indices, rewards):
+            groups[int(index)].append(float(reward))
+
+        with self._lock:
+            self.step += 1
+            rows = []
+            saturated = 0
+            for index, values in groups.items():
+                is_saturated = max(values) - min(values) <= self.tolerance
+                saturated += is_saturated
+                rows.append((index, len(values), sum(value > 0 for value in values),
+                             sum(values) / len(values), int(is_saturated), self.step))
+            self._db.executemany(
+                "INSERT INTO prompt_outcomes (idx, rollouts, passes, last_mean, streak, last_step) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(idx) DO UPDATE SET rollouts = rollouts + excluded.rollouts, passes = passes + excluded.passes, "
+                "last_mean = excluded.last_mean, last_step = excluded.last_step, "
+                "streak = CASE WHEN excluded.streak = 1 THEN streak + 1 ELSE 0 END", rows)
+            self._db.commit()
+        return len(groups), saturated
+
+    def saturated(self, min_streak, reprobe_steps):
+        """Dataset indices saturated for `min_streak` steps in a row and updated less than `reprobe_steps` steps ago."""
+        with self._lock:
+            step = self.current_step()
+            rows = self._db.execute("SELECT idx FROM prompt_outcomes WHERE streak >= ? AND last_step > ?",
+                                    (min_streak, step - reprobe_steps)).fetchall()
+        return {row[0] for row in rows}
+
+    def pass_rates(self):
+        """{dataset index: share of rollouts with reward > 0}"""
+        with self._lock:
+            rows = self._db.execute("SELECT idx, rollouts, passes FROM prompt_outcomes").fetchall()
+        return {index: passes / rollouts for index, rollouts, passes in rows if rollouts}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def dataset_indices(dataset):
+    """`extra_info.index` of every row of an `RLHFDataset`, the row position for datasets without it."""
+    if hasattr(dataset, 'dataset_indices'):
+        return dataset.dataset_indices()
+    dataframe = getattr(dataset, 'dataframe', None)
+    if dataframe is not None and 'extra_info' in getattr(dataframe, 'column_names', []):
+        return [(info or {}).get('index', position) for position, info in enumerate(dataframe['extra_info'])]
+    return list(range(len(dataset)))
+
+
+class SaturationAwareSampler(Sampler):
+    """Shuffled sampler that skips prompts the `PassRateIndex` reports as saturated.
+
+    Every epoch still yields `len(dataset)` rows so the trainer's step count is
+    unchanged: the sampler runs over passes, each a fresh seeded permutation
+    without the currently saturated prompts, and an epoch takes the next
+    `len(dataset)` rows from them. Saturated prompts are kept with probability
+    `keep_prob`. `state_dict` (on the sampler and on its iterator) covers the
+    position inside the epoch for checkpoint resumption.
+    """
+    def __init__(self, dataset, index_path, seed=1, min_streak=2, reprobe_steps=100, keep_prob=0.0) -> None:
+        self.num_rows = len(dataset)
+        self.indices = dataset_indices(dataset)
+        self.index = PassRateIndex(index_path)
+        self.seed = seed
+        self.min_streak = min_streak
+        self.reprobe_steps = reprobe_steps
+        self.keep_prob = keep_prob
+        self.pass_idx = -1
+        self.order = []
+        self.position = 0
+        self.yielded = 0
+
+    def __len__(self):
+        return self.num_rows
+
+    def _start_pass(self):
+        self.pass_idx += 1
+        generator = torch.Generator()
+        generator.manual_seed(self.seed * 100003 + self.pass_idx)
+        permutation = torch.randperm(self.num_rows, generator=generator).tolist()
+        keep = torch.rand(self.num_rows, generator=generator).tolist()
+        saturated = self.index.saturated(self.min_streak, self.reprobe_steps)
+        order = [row for row in permutation if self.indices[row] not in saturated or keep[row] < self.keep_prob]
+        print(f"{type(self).__name__}: pass {self.pass_idx} skips {self.num_rows - len(order)} of {self.num_rows} saturated prompts")
+        # every prompt saturated: nothing to skip to
+        self.order = order or permutation
+        self.position = 0
+
+    def __iter__(self):
+        # a finished epoch starts over, an epoch restored by `load_state_dict` continues
+        if self.yielded >= self.num_rows:
+            self.yielded = 0
+        return SamplerIterator(self)
+
+    def next_row(self):
+        if self.yielded >= self.num_rows:
+            raise StopIteration
+        if self.position >= len(self.order):
+            self._start_pass()
+        row = self.order[self.position]
+        self.position += 1
+        self.yielded += 1
+        return row
+
+    def state_dict(self):
+        return {'pass_idx': self.pass_idx, 'order': list(self.order), 'position': self.position, 'yielded': self.yielded}
+
+    def load_state_dict(self, state_dict):
+        self.pass_idx = state_dict['pass_idx']
+        self.order = list(state_dict['order'])
+        self.position = state_dict['position']
+        self.yielded = state_dict['yielded']
+
+
+class SamplerIterator():
+    """Iterator over the current epoch of a sampler with `next_row`, stateful like the dataloader expects."""
+    def __init__(self, sampler) -> None:
+        self.sampler = sampler
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.sampler.next_row()
+
+    def state_dict(self):
+        return self.sampler.state_dict()
+
+    def load_state_dict(self, state_dict):
+        self.sampler.load_state_dict(state_dict)
@@ -0,0 +1,49 @@
+"""Forward reward manager metrics to the trainer logger.
+
+`RayPPOTrainer.fit` builds its metrics dict internally and the reward function
+only returns per-sample tensors, so step-level reward statistics have no way
+into TensorBoard. `attach_reward_metrics` wraps `Tracking.log` to merge the
+metrics the reward manager accumulated during the step (`pop_metrics`) into
+every logged step. The validation reward manager's metrics are added to the
+validation results under `val/`.
+"""
+
+
+# metrics combined with max instead of summed when merging scoring actors and the driver
+MAX_METRICS = ('latency', 'peak', 'available', 'reward/time/')
+
+
+def merge_metrics(into, metrics):
+    """Add `metrics` into the dict `into`: counts are summed, latencies, peaks and phase times take the max."""
+    for key, value in metrics.items():
+        if any(tag in key for tag in MAX_METRICS):
+            into[key] = max(into.get(key, value), value)
+        else:
+            into[key] = into.get(key, 0) + value
+    return into
+
+
+def attach_reward_metrics(trainer):
+    from verl.utils.tracking import Tracking
+
+    reward_fn, val_reward_fn = trainer.reward_fn, trainer.val_reward_fn
+    log = Tracking.log
+    validate = trainer._validate
+    # train metrics popped before a validation run, logged with the step
+    train_metrics = {}
+
+    def validate_with_reward_metrics(*args, **kwargs):
+        # judge, math and cache counters are shared by the managers of the process: whatever was counted
+        # before validation belongs to training, whatever is counted during it to validation
+        merge_metrics(train_metrics, reward_fn.pop_metrics())
+        metrics = validate(*args, **kwargs)
+        return {**metrics, **{f'val/{key}': value for key, value in val_reward_fn.pop_metrics().items()}}
+
+    def log_with_reward_metrics(self, data, step, *args, **kwargs):
+        data = {**data, **merge_metrics(train_metrics, reward_fn.pop_metrics())}
+        train_metrics.clear()
+        return log(self, data, step, *args, **kwargs)
+
+    if val_reward_fn is not None:
+        trainer._validate = validate_with_reward_metrics
+    Tracking.log = log_with_reward_metrics
@@ -1,7 +1,17 @@
 #-*- coding: utf-8 -*-
+import asyncio
+import random
+from collections import deque
+from contextlib import contextmanager
+import statistics
+import threading
+import time
 import httpx
 import json
-client = httpx.Client()
+from log_writer import get_reward_log
+# one connection per judge thread of the reward manager, created by `get_client` on the first judge request
+client = None
+_client_lock = threading.Lock()
 
 reqUrl = "http://ip:port/v1/chat/completions"
 
@@ -10,16 +20,611 @@ headersList = {
  "Content-Type": "application/json"
 }
 
-def text_generate(messages, url=reqUrl):
+# 多个奖励模型副本时由 configure_endpoints 设置
+endpoint_pool = None
+
+# 可重试的状态码，其余错误直接返回
+TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+
+
+class VerifierError(Exception):
+    """A judge request failed on every attempt."""
+
+
+class JudgeStats():
+    """Per-step statistics of the judge requests sent from this process.
+
+    Both the thread path (`text_generate`) and `AsyncVerifier.generate` run
+    inside `track()`, which records latency, errors, timeouts, cancellations
+    and the number of requests in flight; `parse_reply` counts the replies
+    without a message. `pop()` returns the metrics since the last call.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self._reset()
+
+    def _reset(self):
+        self.latencies = []
+        self.counters = {'judge/requests': 0, 'judge/errors': 0, 'judge/timeouts': 0, 'judge/cancelled': 0,
+                         'judge/stream_requests': 0, 'judge/stream_early_stops': 0, 'judge/unparsed_replies': 0}
+        self.peak_in_flight = self.in_flight
+
+    def add(self, key, n=1):
+        with self._lock:
+            self.counters[key] += n
+            return self.counters[key]
+
+    @contextmanager
+    def track(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        start = time.monotonic()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.counters['judge/requests'] += 1
+                if error is None:
+                    self.latencies.append(time.monotonic() - start)
+                elif isinstance(error, asyncio.CancelledError):
+                    self.counters['judge/cancelled'] += 1
+                else:
+                    self.counters['judge/errors'] += 1
+                    if isinstance(error, httpx.TimeoutException):
+                        self.counters['judge/timeouts'] += 1
+
+    def pop(self):
+        with self._lock:
+            metrics = dict(self.counters)
+            metrics['judge/peak_in_flight'] = self.peak_in_flight
+            latencies = sorted(self.latencies)
+            if latencies:
+                for name, q in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99)]:
+                    metrics[f'judge/latency_{name}'] = latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+                metrics['judge/latency_max'] = latencies[-1]
+            self._reset()
+            return metrics
+
+
+judge_stats = JudgeStats()
+
+
+def sse_delta(line):
+    """Content delta of one `data: {...}` line of a streamed chat completion ('' for anything else)."""
+    if not line.startswith('data:'):
+        return ''
+    data = line[5:].strip()
+    if not data or data == '[DONE]':
+        return ''
+    try:
+        return json.loads(data)["choices"][0]["delta"].get("content") or ''
+    except Exception:
+        return ''
+
+
+def _stream_reply(text):
+    # shaped like a non-streaming reply, so callers parse both the same way
+    return httpx.Response(200, json={"choices": [{"message": {"role": "assistant", "content": text}}]})
+
+
+def send_request(http_client, url, payload, timeout=240, stop=None):
+    """POST a judge request.
+
+    With `stop` (a factory of stop checkers, see `rewards.JUDGE_STOP_POLICIES`)
+    the chat completion is streamed and the connection is closed as soon as
+    the checker reports the score is in, which aborts the generation on the
+    server. The returned response then holds the text received so far.
+    """
+    if stop is None:
+        return http_client.post(url, json=payload, headers=headersList, timeout=timeout)
+    checker = stop()
+    parts = []
+    judge_stats.add('judge/stream_requests')
+    with http_client.stream('POST', url, json={**payload, "stream": True}, headers=headersList, timeout=timeout) as response:
+        if response.status_code != 200:
+            response.read()
+            return response
+        for line in response.iter_lines():
+            delta = sse_delta(line)
+            if delta:
+                parts.append(delta)
+                if checker(delta):
+                    judge_stats.add('judge/stream_early_stops')
+                    break
+    return _stream_reply(''.join(parts))
+
+
+async def async_send_request(http_client, url, payload, timeout=240, stop=None):
+    """Coroutine version of `send_request` for `httpx.AsyncClient`."""
+    if stop is None:
+        return await http_client.post(url, json=payload, headers=headersList, timeout=timeout)
+    checker = stop()
+    parts = []
+    judge_stats.add('judge/stream_requests')
+    async with http_client.stream('POST', url, json={**payload, "stream": True}, headers=headersList, timeout=timeout) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return response
+        async for line in response.aiter_lines():
+            delta = sse_delta(line)
+            if delta:
+                parts.append(delta)
+                if checker(delta):
+                    judge_stats.add('judge/stream_early_stops')
+                    break
+    return _stream_reply(''.join(parts))
+
+
+class VerifierEndpoint():
+    def __init__(self, url) -> None:
+        self.url = url
+        self.completions_url = url.replace('/chat/completions', '/completions')
+        self.health_url = url.split('/v1/')[0] + '/health'
+        self.outstanding = 0
+        self.latency = None  # EWMA of successful request latency, seconds
+        self.samples = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.healthy = True
+        self.ejected_until = 0.0
+
+    def url_for(self, kind):
+        return self.completions_url if kind == 'completions' else self.url
+
+
+class VerifierEndpointPool():
+    """Routes judge requests across several verifier replicas.
+
+    Requests go to the available endpoint with the fewest outstanding requests.
+    Transient failures (connection errors, 429/5xx) are retried with exponential
+    backoff on another replica. A replica whose latency EWMA exceeds
+    `eject_factor` times the median of the others is ejected for
+    `eject_seconds`, as is one that failed `max_consecutive_errors` requests
+    in a row, and a background thread marks replicas unhealthy while
+    their `/health` endpoint fails. If no replica is available, the least loaded
+    one is used anyway rather than failing.
+
+    With `hedge_percentile` (e.g. 0.95) an async request that is still running
+    after that percentile of recent judge latencies is duplicated on another
+    replica; whichever reply comes first wins and the other is cancelled.
+    """
+    def __init__(self, 
+                 urls, 
+                 retries=3, 
+                 backoff=0.5, 
+                 max_backoff=8.0, 
+                 health_interval=30.0, 
+                 eject_factor=3.0, 
+                 eject_seconds=60.0, 
+                 min_samples=20, 
+                 ewma_alpha=0.1,
+                 max_consecutive_errors=3,
+                 hedge_percentile=0.0,
+                 hedge_min_samples=50) -> None:
+        self.endpoints = [VerifierEndpoint(url) for url in urls]
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.eject_factor = eject_factor
+        self.eject_seconds = eject_seconds
+        self.min_samples = min_samples
+        self.ewma_alpha = ewma_alpha
+        self.max_consecutive_errors = max_consecutive_errors
+        self.num_retries = 0
+        self.num_failures = 0
+        self.num_ejections = 0
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.recent_latencies = deque(maxlen=1000)
+        self.num_hedges = 0
+        self.num_hedge_wins = 0
+        self._last_stats = {}
+        self._lock = threading.Lock()
+        if health_interval > 0:
+            self._health_thread = threading.Thread(target=self._check_health, args=(health_interval,), name="verifier-health", daemon=True)
+            self._health_thread.start()
+
+    def acquire(self, exclude=()):
+        with self._lock:
+            now = time.monotonic()
+            available = [e for e in self.endpoints if e.healthy and e.ejected_until <= now and e not in exclude]
+            candidates = available or [e for e in self.endpoints if e not in exclude] or self.endpoints
+            endpoint = min(candidates, key=lambda e: (e.outstanding, e.latency or 0.0))
+            endpoint.outstanding += 1
+            return endpoint
+
+    def release(self, endpoint, latency=None, ok=True):
+        """`ok=False` (transport error, timeout, 429/5xx) counts against the replica, `ok=None` (cancelled request) only gives the slot back."""
+        with self._lock:
+            endpoint.outstanding -= 1
+            if ok is None:
+                return
+            if not ok:
+                endpoint.errors += 1
+                endpoint.consecutive_errors += 1
+                if endpoint.consecutive_errors >= self.max_consecutive_errors:
+                    self._eject(endpoint, f"{endpoint.consecutive_errors} consecutive errors")
+                return
+            endpoint.consecutive_errors = 0
+            if latency is not None:
+                self.recent_latencies.append(latency)
+                if endpoint.latency is None:
+                    endpoint.latency = latency
+                else:
+                    endpoint.latency = (1 - self.ewma_alpha) * endpoint.latency + self.ewma_alpha * latency
+                endpoint.samples += 1
+                self._maybe_eject(endpoint)
+
+    def _maybe_eject(self, endpoint):
+        now = time.monotonic()
+        others = [e.latency for e in self.endpoints 
+                  if e is not endpoint and e.samples >= self.min_samples and e.ejected_until <= now]
+        if endpoint.samples < self.min_samples or not others:
+            return
+        if endpoint.latency > self.eject_factor * statistics.median(others):
+            self._eject(endpoint, f"latency {endpoint.latency:.1f}s vs median {statistics.median(others):.1f}s")
+
+    def _eject(self, endpoint, reason):
+        print(f"VerifierEndpointPool: ejecting replica {endpoint.url} for {self.eject_seconds}s ({reason})")
+        endpoint.ejected_until = time.monotonic() + self.eject_seconds
+        # start from scratch when it comes back
+        endpoint.latency = None
+        endpoint.samples = 0
+        endpoint.consecutive_errors = 0
+        self.num_ejections += 1
+
+    def _check_health(self, interval):
+        with httpx.Client() as health_client:
+            while True:
+                for endpoint in self.endpoints:
+                    try:
+                        endpoint.healthy = health_client.get(endpoint.health_url, timeout=5).status_code == 200
+                    except httpx.HTTPError:
+                        endpoint.healthy = False
+                time.sleep(interval)
+
+    def _backoff(self, attempt):
+        return min(self.backoff * 2 ** attempt, self.max_backoff) * (0.5 + random.random())
+
+    def post(self, http_client, kind, payload, timeout=240, stop=None):
+        """POST `payload` to the chat ('chat') or completions ('completions') endpoint of a replica."""
+        tried = []
+        for attempt in range(self.retries + 1):
+            endpoint = self.acquire(exclude=tried)
+            start = time.monotonic()
+            # any other exception (e.g. a stop callback raising) only gives the slot back
+            ok, latency = None, None
+            try:
+                response = send_request(http_client, endpoint.url_for(kind), payload, timeout=timeout, stop=stop)
+                if response.status_code not in TRANSIENT_STATUS:
+                    # a 4xx (e.g. a prompt over the context length) fails the item, not the replica
+                    ok = True
+                    latency = time.monotonic() - start if response.status_code == 200 else None
+                    return response
+                ok = False
+                error = VerifierError(f"{endpoint.url} returned {response.status_code}")
+            except httpx.TransportError as e:
+                ok = False
+                error = e
+            finally:
+                self.release(endpoint, latency, ok=ok)
+            tried.append(endpoint)
+            if attempt < self.retries:
+                self.num_retries += 1
+                time.sleep(self._backoff(attempt))
+        self.num_failures += 1
+        raise VerifierError(f"judge request failed after {self.retries + 1} attempts") from error
+
+    async def async_post(self, http_client, kind, payload, timeout=240, stop=None, in_use=None):
+        """Coroutine version of `post` for `httpx.AsyncClient`.
+
+        `in_use` is shared by the attempts of a hedged request, so the hedge
+        goes to a replica the original is not running on.
+        """
+        tried = []
+        in_use = [] if in_use is None else in_use
+        for attempt in range(self.retries + 1):
+            endpoint = self.acquire(exclude=tried + in_use)
+            in_use.append(endpoint)
+            start = time.monotonic()
+            try:
+                response = await async_send_request(http_client, endpoint.url_for(kind), payload, timeout=timeout, stop=stop)
+            except httpx.TransportError as e:
+                self.release(endpoint, ok=False)
+                error = e
+            except BaseException:
+                # cancelled by the step deadline or a faster hedge: give the slot back
+                self.release(endpoint, ok=None)
+                raise
+            else:
+                if response.status_code not in TRANSIENT_STATUS:
+                    # as in `post`, only transport errors, timeouts, 429 and 5xx count against the replica
+                    self.release(endpoint, time.monotonic() - start if response.status_code == 200 else None, ok=True)
+                    return response
+                self.release(endpoint, ok=False)
+                error = VerifierError(f"{endpoint.url} returned {response.status_code}")
+            tried.append(endpoint)
+            in_use.remove(endpoint)
+            if attempt < self.retries:
+                self.num_retries += 1
+                await asyncio.sleep(self._backoff(attempt))
+        self.num_failures += 1
+        raise VerifierError(f"judge request failed after {self.retries + 1} attempts") from error
+
+    def hedge_delay(self):
+        """Seconds after which a request is hedged, None while hedging is off or there are too few samples."""
+        if self.hedge_percentile <= 0 or len(self.endpoints) < 2 or len(self.recent_latencies) < self.hedge_min_samples:
+            return None
+        latencies = sorted(self.recent_latencies)
+        return latencies[min(int(self.hedge_percentile * len(latencies)), len(latencies) - 1)]
+
+    async def async_hedged_post(self, http_client, kind, payload, timeout=240, stop=None):
+        """`async_post`, duplicated on a second replica once it runs longer than `hedge_delay()`."""
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self.async_post(http_client, kind, payload, timeout=timeout, stop=stop)
+
+        in_use = []
+        pending = {asyncio.ensure_future(self.async_post(http_client, kind, payload, timeout=timeout, stop=stop, in_use=in_use))}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return done.pop().result()
+
+            self.num_hedges += 1
+            hedge = asyncio.ensure_future(self.async_post(http_client, kind, payload, timeout=timeout, stop=stop, in_use=in_use))
+            pending.add(hedge)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # a failed attempt leaves the other one running
+                winners = [task for task in done if task.exception() is None]
+                if winners:
+                    self.num_hedge_wins += hedge in winners
+                    return winners[0].result()
+                if not pending:
+                    return done.pop().result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        """Counters since start; `pop_stats` gives the per-step deltas."""
+        now = time.monotonic()
+        return {
+            'verifier/retries': self.num_retries,
+            'verifier/failures': self.num_failures,
+            'verifier/ejections': self.num_ejections,
+            'verifier/hedged_requests': self.num_hedges,
+            'verifier/hedge_wins': self.num_hedge_wins,
+            'verifier/available_endpoints': sum(e.healthy and e.ejected_until <= now for e in self.endpoints),
+        }
+
+    def pop_stats(self):
+        """Counters since the last call, for per-step metrics; available_endpoints is the current value."""
+        stats = self.stats()
+        with self._lock:
+            last, self._last_stats = self._last_stats, stats
+        return {key: value if key == 'verifier/available_endpoints' else value - last.get(key, 0)
+                for key, value in stats.items()}
+
+
+def configure_endpoints(urls, max_connections=256, **pool_kwargs):
+    """Route judge requests across `urls` (chat completions URLs of the verifier replicas)."""
+    global endpoint_pool, client
+    if endpoint_pool is None:
+        endpoint_pool = VerifierEndpointPool(urls, **pool_kwargs)
+        client = httpx.Client(limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections))
+    return endpoint_pool
+
+
+def get_client():
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                client = httpx.Client(limits=httpx.Limits(max_connections=128, max_keepalive_connections=128))
+    return client
+
+
+def text_generate(messages, url=None, stop=None):
     payload = {
         "model": "WiNGPT-Verifier",
         "max_tokens":2048,
         "messages":messages,
         "temperature": 0.0
         }
-    data = client.post(url, json=payload, headers=headersList, timeout=240)
+    with judge_stats.track():
+        if url is None and endpoint_pool is not None:
+            data = endpoint_pool.post(get_client(), 'chat', payload, timeout=240, stop=stop)
+        else:
+            data = send_request(get_client(), url or reqUrl, payload, timeout=240, stop=stop)
+    return parse_reply(data)
+
+
+# replies without a message are all counted, only the first ones of each step go to the `judge_errors` log
+UNPARSED_LOG_LIMIT = 5
+
+
+def parse_reply(data):
+    """Message content of a chat completions response, "" if there is none."""
     try:
-        reply = json.loads(data.text)["choices"][0]["message"]['content']
+        return json.loads(data.text)["choices"][0]["message"]['content']
     except Exception as e:
-        reply = ""
-    return reply 
+        if judge_stats.add('judge/unparsed_replies') <= UNPARSED_LOG_LIMIT:
+            get_reward_log('judge_errors').write({'status': data.status_code, 'error': repr(e), 'response': data.text[:2000]})
+        return ""
+
+
+class AsyncVerifier():
+    """Asyncio based verifier client.
+
+    Owns a private event loop running in a daemon thread and one
+    `httpx.AsyncClient`, so thousands of judge requests can be in flight from a
+    single thread. `max_in_flight` bounds the number of concurrent judgments.
+    Replies are parsed exactly like `text_generate`.
+
+    With `batch_size > 1` the chat template of the judge (`tokenizer`, a path or
+    a tokenizer object) is rendered locally and up to `batch_size` judgments,
+    collected for at most `batch_wait` seconds, are packed into one
+    `/v1/completions` request with a list of prompts.
+
+    `generate(messages, stop=...)` streams the reply and stops early, see
+    `send_request`. Batched requests cannot stop a single prompt early and
+    ignore `stop`.
+    """
+    def __init__(self, 
+                 max_in_flight=512, 
+                 url=reqUrl, 
+                 timeout=240, 
+                 batch_size=1, 
+                 batch_wait=0.05, 
+                 tokenizer=None, 
+                 completions_url=None) -> None:
+        self.url = url
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-verifier", daemon=True)
+        self._thread.start()
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._client = None
+
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.completions_url = completions_url or url.replace('/chat/completions', '/completions')
+        self.tokenizer = tokenizer
+        if batch_size > 1:
+            assert tokenizer is not None, "batched judge requests need the verifier tokenizer to render the chat template"
+            if isinstance(tokenizer, str):
+                from transformers import AutoTokenizer
+                self.tokenizer = AutoTokenizer.from_pretrained(tokenizer)
+        self._batch = []
+        self._flush_handle = None
+
+    def _get_client(self):
+        # created lazily on the verifier loop, the client is bound to the loop that first uses it
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+            self._client = httpx.AsyncClient(limits=limits, headers=headersList, timeout=self.timeout)
+        return self._client
+
+    async def generate(self, messages, stop=None):
+        async with self._semaphore:
+            with judge_stats.track():
+                if self.batch_size > 1:
+                    return await self._generate_batched(messages)
+                return await self._generate_chat(messages, stop)
+
+    async def _generate_chat(self, messages, stop=None):
+        payload = {
+            "model": "WiNGPT-Verifier",
+            "max_tokens":2048,
+            "messages":messages,
+            "temperature": 0.0
+            }
+        data = await self._post('chat', payload, stop)
+        return parse_reply(data)
+
+    async def _generate_batched(self, messages):
+        prompt = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        future = self._loop.create_future()
+        self._batch.append((prompt, future))
+        if len(self._batch) >= self.batch_size:
+            self._flush_batch()
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self.batch_wait, self._flush_batch)
+        return await future
+
+    def _flush_batch(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._batch = self._batch, []
+        if batch:
+            self._loop.create_task(self._send_batch(batch))
+
+    async def _send_batch(self, batch):
+        try:
+            replies = await self._post_completions([prompt for prompt, _ in batch])
+            results = [(future, reply, None) for (_, future), reply in zip(batch, replies)]
+        except Exception as e:
+            if len(batch) == 1:
+                results = [(batch[0][1], None, e)]
+            else:
+                # one bad prompt (e.g. over the context length) rejects the whole request,
+                # resend every prompt on its own so the failure stays with that item
+                outcomes = await asyncio.gather(*[self._post_completions([prompt]) for prompt, _ in batch], return_exceptions=True)
+                results = [(future, None, outcome) if isinstance(outcome, Exception) else (future, outcome[0], None)
+                           for (_, future), outcome in zip(batch, outcomes)]
+
+        for future, reply, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(reply)
+
+    async def _post_completions(self, prompts):
+        """Send one completions request, returns the replies in prompt order ("" for a missing choice)."""
+        payload = {
+            "model": "WiNGPT-Verifier",
+            "max_tokens":2048,
+            "prompt":prompts,
+            "temperature": 0.0
+            }
+        data = await self._post('completions', payload)
+        data.raise_for_status()
+        replies = [""] * len(prompts)
+        for choice in json.loads(data.text)["choices"]:
+            try:
+                replies[choice["index"]] = choice["text"]
+            except Exception:
+                pass
+        return replies
+
+    async def _post(self, kind, payload, stop=None):
+        if endpoint_pool is not None:
+            return await endpoint_pool.async_hedged_post(self._get_client(), kind, payload, timeout=self.timeout, stop=stop)
+        return await async_send_request(self._get_client(), self.completions_url if kind == 'completions' else self.url, 
+                                        payload, timeout=self.timeout, stop=stop)
+
+    def submit(self, coro):
+        """Schedule `coro` on the verifier loop and return a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run_all(self, coros, timeout=None, timed_out=None):
+        """Run `coros` concurrently on the verifier loop and return their results in order.
+
+        The result of a coroutine that raised is None, and with `timeout` (seconds)
+        whatever is still running then is cancelled and its result is None too;
+        the positions of those are added to the `timed_out` set if one is given.
+        """
+        async def gather():
+            tasks = [asyncio.ensure_future(coro) for coro in coros]
+            if not tasks:
+                return []
+            done, pending = await asyncio.wait(tasks, timeout=None if timeout is None else max(timeout, 0.0))
+            for task in pending:
+                task.cancel()
+            if timed_out is not None:
+                timed_out.update(k for k, task in enumerate(tasks) if task in pending)
+            failed = [task for task in done if task.exception() is not None]
+            if failed:
+                print(f"AsyncVerifier: {len(failed)} of {len(tasks)} coroutines failed, first: {failed[0].exception()!r}")
+            return [task.result() if task in done and task not in failed else None for task in tasks]
+        return self.submit(gather()).result()
+
+    def close(self):
+        if self._client is not None:
+            self.submit(self._client.aclose()).result()
+            self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
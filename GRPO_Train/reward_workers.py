@@ -0,0 +1,70 @@
+"""Ray actor pool for reward scoring.
+
+By default all reward work runs inside the single-CPU TaskRunner actor. With
+`reward_workers` set, the reward manager only decodes on the driver and ships
+the decoded items to a pool of CPU actors, each holding its own copy of the
+manager (math process pool, verifier client, ...).
+"""
+import os
+
+import ray
+
+from reward_metrics import merge_metrics
+
+
+@ray.remote(num_cpus=1)
+class RewardScoringWorker:
+    def __init__(self, manager_cls, manager_kwargs):
+        # scoring only works on decoded text, so the actor needs no tokenizer
+        # every actor appends to its own judge log file
+        self.manager = manager_cls(tokenizer=None, num_examine=0, log_suffix=f'-{os.getpid()}', **manager_kwargs)
+
+    def score_items(self, items, timeout=None):
+        # the items that missed the deadline and the metrics of the actor's manager travel back with the scores
+        self.manager.timed_out = set()
+        scores = self.manager.score_items(items, timeout=timeout)
+        return scores, self.manager.timed_out, self.manager.pop_metrics()
+
+
+def resolve_num_reward_workers(reward_workers, num_cpus=None):
+    """`reward_workers=-1` sizes the pool from the idle CPUs of the cluster, capped by `ray_init.num_cpus - 1`."""
+    if reward_workers >= 0:
+        return reward_workers
+    available = int(ray.available_resources().get("CPU", 1))
+    if num_cpus:
+        available = min(available, num_cpus - 1)
+    return max(available, 1)
+
+
+class RewardWorkerPool():
+    """Shards decoded items across `RewardScoringWorker` actors and reassembles the results in order."""
+    def __init__(self, manager_cls, manager_kwargs, num_workers, num_cpus=None) -> None:
+        num_workers = resolve_num_reward_workers(num_workers, num_cpus)
+        self.workers = [RewardScoringWorker.remote(manager_cls, manager_kwargs) for _ in range(num_workers)]
+        print(f"RewardWorkerPool: scoring rewards on {num_workers} ray actors")
+
+    def score(self, items, timeout=None):
+        """Returns ((i, score) pairs, indices of the items that missed the deadline, summed actor metrics)."""
+        if not items:
+            return [], set(), {}
+        # contiguous shards keep the rollouts of one prompt on the same actor
+        shard_size = -(-len(items) // len(self.workers))
+        refs = [worker.score_items.remote(items[start:start + shard_size], timeout)
+                for worker, start in zip(self.workers, range(0, len(items), shard_size))]
+
+        results, timed_out, metrics = [], set(), {}
+        for shard_results, shard_timed_out, shard_metrics in ray.get(refs):
+            results.extend(shard_results)
+            timed_out.update(shard_timed_out)
+            merge_metrics(metrics, shard_metrics)
+        return results, timed_out, metrics
+
+
+# train and validation managers of the same class share one pool of actors
+_worker_pools = {}
+
+
+def get_worker_pool(manager_cls, manager_kwargs, num_workers, num_cpus=None):
+    if manager_cls.__name__ not in _worker_pools:
+        _worker_pools[manager_cls.__name__] = RewardWorkerPool(manager_cls, manager_kwargs, num_workers, num_cpus)
+    return _worker_pools[manager_cls.__name__]
@@ -1,11 +1,22 @@
 """Reward functions for GRPO training."""
 import re
-from math_verify import parse, verify
-import time
+from functools import lru_cache, partial
 from reward_model_api import text_generate
-import json
+from verifier_cache import VerifierCache
+from log_writer import get_reward_log
+from math_match import fast_match, remember
 
-strtime = time.strftime("%Y%m%d")
+
+# 奖励模型结果缓存，由 reward manager 通过 set_verifier_cache 开启
+verifier_cache = None
+
+
+def set_verifier_cache(max_entries, path=None):
+    """开启奖励模型结果缓存；同一进程内只创建一次（训练和验证的 reward manager 共用）"""
+    global verifier_cache
+    if verifier_cache is None:
+        verifier_cache = VerifierCache(max_entries=max_entries, path=path)
+    return verifier_cache
 
 
 verifier_prompt:str = '''
@@ -62,6 +73,77 @@ assistant：{插入待评估答案}
 '''
 
 
+# 分数在前的模板：先输出分数再分析，配合流式 stop policy 在分数给出后即可结束生成
+verifier_prompt_score_first:str = '''
+你是一名专业的评估专家，需根据以下四个核心要素来对「预测答案」进行质量评估：
+
+- **对话历史**（上下文信息）
+- **当前问题**（用户提出的具体请求）
+- **优秀答案**（经过审核的高质量参考答案）
+- **预测答案**（待评估的答案）
+
+### ⭐ 评分标准：
+- **满分**：满分100分，表示「预测答案」质量高，与「优秀答案」相当或接近，满足用户需求；
+- **扣分**：根据「预测答案」存在的问题---幻觉、遗漏、错误或无法满足用户需求等，进行相应的扣分；
+
+> 注意：「优秀答案」已通过严格审核，其质量被认为是高标准的，可作为判断基准。
+
+请按照以下结构输出你的评估结果，**先给出评估分数，再给出评估分析**：
+
+---
+
+### 📜 对话历史（按时间顺序排列，从最早到最新）
+```
+{插入对话历史}
+```
+
+### ❓ 当前问题
+```
+{插入原始问题}
+```
+
+### ✅ 优秀答案（参考答案）
+```
+assistant：{插入优秀答案}
+```
+
+### 🤖 预测答案（待评估答案）
+```
+assistant：{插入待评估答案}
+```
+
+---
+
+### 📌 预测答案评估分数
+
+\\boxed{预测答案评估分数}
+
+---
+
+### 📊 评估分析
+
+[在此处进行逐项对比分析]
+
+---
+'''
+
+
+VERIFIER_PROMPTS = {'default': verifier_prompt, 'score_first': verifier_prompt_score_first}
+
+# 奖励模型模板与流式 stop policy，由 reward manager 通过 set_judge_options 设置
+judge_template = 'default'
+judge_stop = None
+
+
+# 预编译的规则正则，避免每次调用都经过 re 模块的缓存查找
+QC_PATTERN = re.compile(r'(true|false)')
+CHOICE_PATTERN = re.compile(r'\\boxed\{(?:\\text\{)?([ABCDEFG])(?:\..*)?(?:\})?\}')
+BOXED_PATTERN = re.compile(r'\\boxed\{([^}]*)\}')
+SCORE_PATTERN = re.compile(r'(\d{1,3}(?:\.\d{1,2})?)\s*(?:分)?\b')
+EQUALS_SCORE_PATTERN = re.compile(r'=\s*(\d{1,3}(?:\.\d{1,2})?)\b')
+THINK_PATTERN = re.compile(r"^<think>\n.*\n</think>\n.+", flags=re.DOTALL)  # 允许 . 匹配换行符
+
+
 def extract_evaluation_score(response: str) -> float:
     """
     从模型回复中提取评估分数（最后一个\\boxed{}中的0-100分数字），
@@ -74,7 +156,7 @@ def extract_evaluation_score(response: str) -> float:
         提取并处理后的分数（0.0-1.0之间的浮点数）
     """
     # 匹配所有\boxed{}内容
-    boxes = re.findall(r'\\boxed\{([^}]*)\}', response)
+    boxes = BOXED_PATTERN.findall(response)
     
     if not boxes:
         return 0.0
@@ -83,10 +165,7 @@ def extract_evaluation_score(response: str) -> float:
     last_box = boxes[-1].strip()
     
     # 改进的数字匹配：支持整数和小数格式（如95, 96.5, 85分）
-    score_match = re.search(
-        r'(\d{1,3}(?:\.\d{1,2})?)\s*(?:分)?\b', 
-        last_box
-    )
+    score_match = SCORE_PATTERN.search(last_box)
     
     if score_match:
         try:
@@ -102,7 +181,7 @@ def extract_evaluation_score(response: str) -> float:
             return 0.0
     
     # 额外尝试匹配带等号的分数（如"=96.5"）
-    equals_match = re.search(r'=\s*(\d{1,3}(?:\.\d{1,2})?)\b', last_box)
+    equals_match = EQUALS_SCORE_PATTERN.search(last_box)
     if equals_match:
         try:
             score = float(equals_match.group(1))
@@ -115,12 +194,10 @@ def extract_evaluation_score(response: str) -> float:
 
 def think_format_reward(content):
     """Reward function that checks if the completion has a specific format."""
-    pattern = r"^<think>\n.*\n</think>\n.+"
-    flags = re.DOTALL  # 允许 . 匹配换行符
     required_tags = ['<think>', '</think>']
     
     # 检查整体结构是否符合正则表达式
-    struct_match = re.fullmatch(pattern, content, flags=flags)
+    struct_match = THINK_PATTERN.fullmatch(content)
     if not struct_match:
         return False
 
@@ -132,63 +209,195 @@ def think_format_reward(content):
         return False
 
 
-def get_reward(message, output, target, task, limit):
-    if task == "quality-control":
-        matches_text1 = re.findall(r'(true|false)', output)
-        matches_text2 = re.findall(r'(true|false)', target)
-        if matches_text1 == matches_text2:
-            reward = 1.0
-        else:
-            reward = 0.0
-                   
-    elif task == 'math':
+# 规则打分的任务及其打分函数，由 register_reward 注册；未注册的任务均交给生成式奖励模型评估
+REWARD_FUNCTIONS = {}
+# 随注册实时更新的视图
+RULE_TASKS = REWARD_FUNCTIONS.keys()
+
+
+def register_reward(*tasks):
+    """注册规则任务的打分函数 fn(message, output, target, limit) -> float"""
+    def decorator(fn):
+        for task in tasks:
+            REWARD_FUNCTIONS[task] = fn
+        return fn
+    return decorator
+
+
+class BoxedScoreStop():
+    """流式 stop policy：已生成的文本中出现带分数的 \\boxed{} 时返回 True
+
+    after 不为 None 时，只认该标记之后的 \\boxed{}
+    """
+    def __init__(self, after=None) -> None:
+        self.text = ''
+        self.after = after
+        self.start = 0  # 之前的文本已检查过，下次从这里开始匹配
+
+    def __call__(self, delta):
+        self.text += delta
+        if self.after is not None:
+            marker = self.text.find(self.after)
+            if marker < 0:
+                return False
+            self.start = max(self.start, marker + len(self.after))
+        for match in BOXED_PATTERN.finditer(self.text, self.start):
+            if SCORE_PATTERN.search(match.group(1)):
+                return True
+            self.start = match.end()
+        # 可能还未闭合的 \boxed{ 留到下次匹配
+        opened = self.text.rfind('\\boxed{', self.start)
+        self.start = opened if opened >= 0 else max(self.start, len(self.text) - len('\\boxed{'))
+        return False
+
+
+JUDGE_STOP_POLICIES = {
+    None: None,
+    # 第一个带分数的 \boxed{} 出现即停止
+    'boxed': BoxedScoreStop,
+    # 只认「预测答案评估分数」标题之后的 \boxed{}，避免分析中引用的 \boxed{} 提前结束
+    'score_section': partial(BoxedScoreStop, after='预测答案评估分数'),
+}
+
+
+def set_judge_options(template='default', stop_policy=None):
+    """选择奖励模型模板（VERIFIER_PROMPTS）和流式 stop policy（JUDGE_STOP_POLICIES）"""
+    global judge_template, judge_stop
+    assert template in VERIFIER_PROMPTS, f"unknown verifier template {template}, expected one of {list(VERIFIER_PROMPTS)}"
+    assert stop_policy in JUDGE_STOP_POLICIES, f"unknown {stop_policy=}, expected one of {list(JUDGE_STOP_POLICIES)}"
+    judge_template = template
+    judge_stop = JUDGE_STOP_POLICIES[stop_policy]
+
+
+@lru_cache(maxsize=4096)
+def verifier_template(message_key, target, template='default'):
+    """填入对话历史、问题和优秀答案，同一 prompt 的所有 rollout 共用
+
+    message_key 为 ((role, content), ...)，返回 (按预测答案占位符切分后的 prompt, question)
+    """
+    prompt = VERIFIER_PROMPTS[template].strip()
+
+    if len(message_key)>=3:
+        chathistory = message_key[:-1]
+        history  = '\n'.join([role+'：'+content.strip() for role, content in chathistory])
+        prompt = prompt.replace('{插入对话历史}', history)
+        question = 'user：' + message_key[-1][1].strip()
+    else:
+        prompt = prompt.replace('{插入对话历史}', '无')
+        question = '\n'.join([role+'：'+content.strip() for role, content in message_key])
+
+    prompt = prompt.replace('{插入原始问题}', question.strip())
+    prompt = prompt.replace('{插入优秀答案}', target.strip())
+    return tuple(prompt.split('{插入待评估答案}')), question
+
+
+def build_verifier_chat(message, output, target):
+    """构造奖励模型的输入，返回 (chat, question)"""
+    prompt_parts, question = verifier_template(tuple((k['role'], k['content']) for k in message), target, judge_template)
+    # 与 prompt.replace('{插入待评估答案}', output.strip()) 等价，每个 rollout 只需拼接一次
+    prompt = output.strip().join(prompt_parts)
+    
+    chat = [{"role": "user", "content": prompt}]
+    return chat, question
+
+
+@lru_cache(maxsize=4096)
+def target_matches(pattern, target):
+    """同一 prompt 的参考答案只需匹配一次"""
+    return pattern.findall(target)
+
+
+def score_verifier_answer(question, target, output, verifier_answer):
+    """解析奖励模型的评估结果并记录日志"""
+    reward = extract_evaluation_score(verifier_answer.strip())
+    get_reward_log('model_verifier').write({'question':question,'solution':target, 'output':output, 'generated':verifier_answer, 'reward_score':reward})
+    return reward
+
+
+def cached_text_generate(chat):
+    if verifier_cache is None:
+        return text_generate(chat, stop=judge_stop)
+    key = verifier_cache.key(chat)
+    verifier_answer = verifier_cache.get(key)
+    if verifier_answer is None:
+        verifier_answer = text_generate(chat, stop=judge_stop)
+        verifier_cache.put(key, verifier_answer)
+    return verifier_answer
+
+
+async def async_cached_text_generate(chat, verifier):
+    if verifier_cache is None:
+        return await verifier.generate(chat, stop=judge_stop)
+    key = verifier_cache.key(chat)
+    verifier_answer = verifier_cache.get(key)
+    if verifier_answer is None:
+        verifier_answer = await verifier.generate(chat, stop=judge_stop)
+        verifier_cache.put(key, verifier_answer)
+    return verifier_answer
+
+
+@register_reward('quality-control')
+def quality_control_reward(message, output, target, limit):
+    matches_text1 = QC_PATTERN.findall(output)
+    matches_text2 = target_matches(QC_PATTERN, target)
+    if matches_text1 == matches_text2:
+        return 1.0
+    else:
+        return 0.0
+
+
+@register_reward('math')
+def math_reward(message, output, target, limit):
+    # 先用字符串/数值比较，无法判断时再交给 math_verify
+    reward, key = fast_match(output, target, 'math', limit)
+    if reward is None:
+        # math_verify 会一并导入 sympy，只在第一次需要时导入
+        from math_verify import parse, verify
         answer = parse(output)
         reward = float(verify(answer, parse(target)))
-        
-    elif task == 'choice':
-        matches_text1 = re.findall(r'\\boxed\{(?:\\text\{)?([ABCDEFG])(?:\..*)?(?:\})?\}', output)
-        matches_text2 = re.findall(r'\\boxed\{(?:\\text\{)?([ABCDEFG])(?:\..*)?(?:\})?\}', target)
-        if matches_text1 == matches_text2:
-            reward = 1.0
-        else:
-            reward = 0.0
-    
-    elif task == 'MedCalc-Bench':
+        remember(key, reward)
+    return reward
+
+
+@register_reward('choice')
+def choice_reward(message, output, target, limit):
+    matches_text1 = CHOICE_PATTERN.findall(output)
+    matches_text2 = target_matches(CHOICE_PATTERN, target)
+    if matches_text1 == matches_text2:
+        return 1.0
+    else:
+        return 0.0
+
+
+@register_reward('MedCalc-Bench')
+def medcalc_reward(message, output, target, limit):
+    reward, key = fast_match(output, target, 'MedCalc-Bench', limit)
+    if reward is None:
+        from math_verify import parse
         answer = parse(output)[0]
         if limit[0] <= answer <= limit[1]:
             reward = 1.0
         else:
             reward = 0.0
-             
-    else:
-        prompt = verifier_prompt.strip()
+        remember(key, reward)
+    return reward
 
-        if len(message)>=3:
-            chathistory = message[:-1]
-            history  = '\n'.join([k['role']+'：'+k['content'].strip() for k in chathistory])
-            prompt = prompt.replace('{插入对话历史}', history)
-            question = 'user：' + message[-1]['content'].strip()
-        else:
-            prompt = prompt.replace('{插入对话历史}', '无')
-            question = '\n'.join([k['role']+'：'+k['content'].strip() for k in message])
 
-        prompt = prompt.replace('{插入原始问题}', question.strip())
-        prompt = prompt.replace('{插入优秀答案}', target.strip())
-        prompt = prompt.replace('{插入待评估答案}', output.strip())
-        
-        # 模型处理流程
-        chat = [{"role": "user", "content": prompt}]
-        verifier_answer = text_generate(chat)
+def judge_reward(message, output, target, limit):
+    # 模型处理流程
+    chat, question = build_verifier_chat(message, output, target)
+    try:
+        verifier_answer = cached_text_generate(chat)
+    except Exception:
+        # 重试后仍失败：返回 None，由 RewardManager 按 reward_fallback 打分并记录
+        return None
+    if not verifier_answer:
+        return None
+    return score_verifier_answer(question, target, output, verifier_answer)
 
-        reward = extract_evaluation_score(verifier_answer.strip())
-            
-        try:
-            with open(f'/workspace/LLM-Train/LLM-RL/LLM-veRL/log_date/{strtime}-model_verifier.json', 'a+', encoding='utf-8') as target_file:
-                target_file.write(json.dumps({'question':question,'solution':target, 'output':output, 'generated':verifier_answer, 'reward_score':reward}, ensure_ascii=False) + '\n')
-        except:
-            pass
-    
-    return reward
+
+def get_reward(message, output, target, task, limit):
+    return REWARD_FUNCTIONS.get(task, judge_reward)(message, output, target, limit)
 
 
 def calculate_reward(output_length):
@@ -210,7 +419,10 @@ def calculate_reward(output_length):
 
 
 def accuracy_reward(messages, content, solution, task, limit, output_length):
-    """Reward function that checks if the completion is the same as the ground truth."""
+    """Reward function that checks if the completion is the same as the ground truth.
+
+    None when the reward model could not score the completion (request failed or empty reply).
+    """
     # Reward 1 if the content is the same as the ground truth, 0 otherwise
     # Shorter correct solutions are rewarded more than longer ones. add cosine
     
@@ -225,3 +437,38 @@ def accuracy_reward(messages, content, solution, task, limit, output_length):
           
     except Exception:  # if it fails for any reason, return 0.0
         return 0.0
+
+
+def fast_accuracy_reward(content, solution, task, limit):
+    """`accuracy_reward` 中无需 math_verify 的部分（数学类任务），返回 (reward, key)，无法判断时 reward 为 None"""
+    if not content.endswith('<|im_end|>'):
+        return 0.0, None
+    try:
+        return fast_match(content.replace('<|im_end|>', '').strip(), solution, task, limit)
+    except Exception:
+        return None, None
+
+
+async def async_accuracy_reward(messages, content, solution, task, limit, output_length, verifier):
+    """`accuracy_reward` 的协程版本，奖励模型请求通过 `verifier`（AsyncVerifier）异步发送"""
+    try:
+        if not content.endswith('<|im_end|>'):
+            return 0.0
+        else:
+            content = content.replace('<|im_end|>', '')
+            output = content.strip()
+            if task in RULE_TASKS:
+                return get_reward(messages, output, solution, task, limit)
+            
+            chat, question = build_verifier_chat(messages, output, solution)
+            try:
+                verifier_answer = await async_cached_text_generate(chat, verifier)
+            except Exception:
+                # 与 judge_reward 相同，奖励模型失败返回 None
+                return None
+            if not verifier_answer:
+                return None
+            return score_verifier_answer(question, solution, output, verifier_answer)
+          
+    except Exception:  # if it fails for any reason, return 0.0
+        return 0.0
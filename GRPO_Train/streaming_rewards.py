@@ -0,0 +1,127 @@
+"""Streaming reward scoring for async rollout.
+
+With `rollout.mode == "async"` sequences finish one by one, but the reward
+manager only runs once the whole batch is back. `StreamingRewardScorer` lets the
+rollout side hand over every response as soon as it finishes: each one is
+scored on the async verifier loop by the `TaskScorer` of its task, so by the
+time the last long-tail sequence completes most scores are already available.
+The reward manager then only waits for what is still in flight and scores
+anything it has not seen before as usual.
+
+The producer is `streaming_rollout.StreamingCompletionCallback`, the async
+rollout completion callback. It only sees the chat messages, so the scorer of
+the training reward function indexes the prompts of the train dataset
+(`index_prompts`) to find their reference answer, task and limits.
+"""
+import hashlib
+import json
+import threading
+
+from task_scorers import get_task_scorer
+
+
+def stream_key(messages, output):
+    return (json.dumps(list(messages), ensure_ascii=False, sort_keys=True, default=str), output)
+
+
+def prompt_hash(messages):
+    return hashlib.blake2b(stream_key(messages, '')[0].encode('utf-8'), digest_size=16).digest()
+
+
+def dataset_prompts(dataset):
+    """Prompt messages of every item of an `RLHFDataset` (or a dataset with `prompts()`)."""
+    if hasattr(dataset, 'prompts'):
+        return dataset.prompts()
+    return dataset.dataframe[dataset.prompt_key]
+
+
+def dataset_row(dataset, item):
+    """Raw columns (reward_model, data_task, limits, ...) of one item."""
+    if hasattr(dataset, 'raw_row'):
+        return dataset.raw_row(item)
+    return dataset.dataframe[item]
+
+
+# the scorer fed by the rollout callback, set by `index_prompts`
+_active_stream = None
+
+
+def active_stream():
+    return _active_stream
+
+
+def attach_streaming_rollout(reward_fn, config, train_dataset):
+    """Feed `reward_fn` (created with streaming=True) from the async rollout, see streaming_rollout.py."""
+    if reward_fn.stream is None:
+        return
+    rollout = config.actor_rollout_ref.rollout
+    assert rollout.mode == "async" and rollout.multi_turn.completion_callback, \
+        "streaming rewards need rollout.mode=async and multi_turn.completion_callback=streaming_rollout.StreamingCompletionCallback"
+    reward_fn.stream.index_prompts(train_dataset)
+
+
+class StreamingRewardScorer():
+    def __init__(self, manager) -> None:
+        assert manager.verifier is not None, "streaming rewards need verifier_mode='async'"
+        self.manager = manager
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._dataset = None
+        self._prompt_items = {}
+
+    def index_prompts(self, dataset):
+        """Make this the scorer `active_stream()` returns, for the prompts of `dataset`."""
+        global _active_stream
+        self._dataset = dataset
+        # 16-byte hashes instead of the prompts themselves, the metadata is read from the dataset on demand
+        self._prompt_items = {prompt_hash(messages): item for item, messages in enumerate(dataset_prompts(dataset))}
+        _active_stream = self
+        print(f"{type(self).__name__}: indexed {len(self._prompt_items)} prompts for streaming rewards")
+
+    def submit_rollout(self, messages, response_ids):
+        """`submit` for a prompt of the indexed dataset, returns False for other prompts (e.g. validation)."""
+        item = self._prompt_items.get(prompt_hash(messages))
+        if item is None:
+            return False
+        row = dataset_row(self._dataset, item)
+        self.submit(messages, response_ids, row['reward_model']['ground_truth'], row['data_task'], row['limits'])
+        return True
+
+    def submit(self, messages, response_ids, ground_truth, task, limit):
+        """Start scoring one finished response. Safe to call from any thread."""
+        scorer = get_task_scorer(task)
+        # tasks whose scorer cannot run on the verifier loop (math) are scored in batch anyway
+        if not scorer.streamable:
+            return
+        # decoded exactly like `decode_batch`, so the text matches the batch item
+        output = self.manager._batch_decode([list(response_ids)])[0].strip()
+        key = stream_key(messages, output)
+        with self._lock:
+            # identical completions of a prompt share one scoring request
+            if key in self._pending:
+                return
+            item = (None, messages, output, ground_truth, task, limit, len(response_ids))
+            self._pending[key] = self.manager.verifier.submit(scorer.score_streamed(self.manager, item))
+
+    def take(self, items):
+        """Split decoded items into ([(item, future), ...], rest).
+
+        Items without a streamed score end up in `rest`. Pending requests that
+        no item of the batch claimed are cancelled.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        streamed, rest, used = [], [], set()
+        for item in items:
+            key = stream_key(item[1], item[2])
+            if key in pending:
+                streamed.append((item, pending[key]))
+                used.add(key)
+            else:
+                rest.append(item)
+
+        for key, future in pending.items():
+            if key not in used:
+                future.cancel()
+        return streamed, rest
@@ -0,0 +1,36 @@
+"""Async rollout completion callback that feeds finished responses to the streaming reward scorer.
+
+    actor_rollout_ref.rollout.mode=async
+    data.return_raw_chat=True
+    actor_rollout_ref.rollout.multi_turn.completion_callback=streaming_rollout.StreamingCompletionCallback
+    +reward_model.reward_kwargs.verifier_mode=async
+    +reward_model.reward_kwargs.streaming=true
+
+verl's `ChatCompletionScheduler` calls its completion callback as soon as the
+server returns a chat completion. `StreamingCompletionCallback` keeps the
+default behaviour (`ToolCompletionCallback` appends the reply and handles tool
+calls) and hands every finished conversation to the `StreamingRewardScorer` of
+the training reward function, which main_grpo.py / main_dapo.py point at the
+train dataset. The callback runs in the trainer process, next to the reward
+function, so no data has to cross processes.
+"""
+from verl.workers.rollout.chat_scheduler import ToolCompletionCallback
+
+from streaming_rewards import active_stream
+
+
+class StreamingCompletionCallback(ToolCompletionCallback):
+    async def __call__(self, messages, completions, info):
+        await super().__call__(messages, completions, info)
+        stream = active_stream()
+        # a tool call continues the conversation, only the final reply is scored
+        if stream is None or completions.choices[0].finish_reason == "tool_calls":
+            return
+        stream.submit_rollout(messages[:-1], self.response_ids(messages))
+
+    def response_ids(self, messages):
+        """Response tokens of a finished conversation, built like `postprocess` builds the batch responses."""
+        prompt = self.tokenizer.apply_chat_template(messages[:-1], tools=self.tool_schemas, add_generation_prompt=True, tokenize=False)
+        sequence = self.tokenizer.apply_chat_template(messages, tools=self.tool_schemas, add_generation_prompt=False, tokenize=False)
+        response_length = self.config.actor_rollout_ref.rollout.response_length
+        return self.tokenizer(sequence[len(prompt):], add_special_tokens=False)["input_ids"][:response_length]
@@ -0,0 +1,127 @@
+"""Batch scorers per task.
+
+The reward manager groups the decoded items of a step by task and hands every
+group to the `TaskScorer` registered for it, so each task runs with the
+execution strategy that suits it:
+
+- `RuleScorer`: regex rules, scored inline (a thread hand-off would cost more
+  than the check); the default for every task registered with
+  `rewards.register_reward`
+- `MathScorer`: math_verify tasks, through the manager's process pool when
+  `math_workers > 0`
+- `JudgeScorer`: everything else, generative judge requests ordered by prompt
+  group and sent from the thread pool or the async verifier, in a background
+  thread so they overlap with the math pool
+
+A new rule task only needs `@register_reward('task')` in rewards.py; a task with
+its own strategy adds a `TaskScorer` subclass and `register_task_scorer`.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from rewards import RULE_TASKS
+
+
+class TaskScorer():
+    """Scores all items of its tasks in a step.
+
+    `score` returns (i, raw score) pairs, with score None for items that missed
+    `timeout` (seconds) or could not be scored; those still running at the
+    timeout are added to `manager.timed_out`. `background` scorers (network
+    bound) are started first, each in its own thread; the others then run in
+    ascending `order` on the calling thread, which math_verify's signal based
+    timeouts need.
+    """
+    name = 'task'
+    order = 0
+    background = False
+    # whether `StreamingRewardScorer` may score these tasks on the async verifier loop
+    streamable = True
+
+    def score(self, manager, items, timeout=None):
+        raise NotImplementedError
+
+    async def score_streamed(self, manager, item):
+        """Raw score of one item handed over by `StreamingRewardScorer`, run on the verifier loop.
+
+        The default scores a one-item batch inline, so it must be quick; scorers
+        that wait on I/O override it with a coroutine.
+        """
+        return self.score(manager, [item])[0][1]
+
+
+class RuleScorer(TaskScorer):
+    name = 'rules'
+    order = 10
+
+    def score(self, manager, items, timeout=None):
+        return [manager.process_single_item(item) for item in items]
+
+
+class MathScorer(TaskScorer):
+    name = 'math'
+    order = 0
+    # math_verify relies on signal.alarm, which only works in the main thread
+    streamable = False
+
+    def score(self, manager, items, timeout=None):
+        if manager.math_pool is None:
+            return [manager.process_single_item(item) for item in items]
+        math_timeouts = manager.math_pool.num_timeouts
+        results = manager.process_math_items(items)
+        manager.metrics['reward/math_timeouts'] += manager.math_pool.num_timeouts - math_timeouts
+        return results
+
+
+class JudgeScorer(TaskScorer):
+    name = 'judge'
+    order = 100
+    # overlaps with the math pool instead of waiting for it
+    background = True
+
+    def score(self, manager, items, timeout=None):
+        if manager.scheduler is not None:
+            items, stats = manager.scheduler.order(items)
+            for key, value in stats.items():
+                manager.metrics[key] += value
+
+        if manager.verifier is not None:
+            pending = set()
+            results = manager.verifier.run_all([manager.process_judge_item_async(item) for item in items], timeout=timeout, timed_out=pending)
+            manager.timed_out.update(items[k][0] for k in pending)
+            return [result or (item[0], None) for item, result in zip(items, results)]
+
+        # thread mode has no deadline (the manager only allows one with verifier_mode='async'), every request runs to the end
+        with ThreadPoolExecutor(max_workers=128) as executor:
+            futures = [executor.submit(manager.process_judge_item, item) for item in items]
+        return [future.result() if future.exception() is None else (item[0], None) for item, future in zip(items, futures)]
+
+    async def score_streamed(self, manager, item):
+        return (await manager.process_single_item_async(item))[1]
+
+
+TASK_SCORERS = {}
+RULE_SCORER = RuleScorer()
+JUDGE_SCORER = JudgeScorer()
+
+
+def register_task_scorer(scorer, *tasks):
+    for task in tasks:
+        TASK_SCORERS[task] = scorer
+    return scorer
+
+
+register_task_scorer(MathScorer(), 'math', 'MedCalc-Bench')
+
+
+def get_task_scorer(task):
+    if task in TASK_SCORERS:
+        return TASK_SCORERS[task]
+    return RULE_SCORER if task in RULE_TASKS else JUDGE_SCORER
+
+
+def group_by_scorer(items):
+    """[(scorer, items), ...] in the order the scorers should run."""
+    groups = {}
+    for item in items:
+        groups.setdefault(get_task_scorer(item[4]), []).append(item)
+    return sorted(groups.items(), key=lambda pair: pair[0].order)
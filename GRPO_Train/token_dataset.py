@@ -0,0 +1,183 @@
+"""Pre-tokenized prompt dataset read from memory-mapped files.
+
+`RLHFDataset` loads the parquet files into every process that holds the dataset
+(the trainer and each dataloader worker) and tokenizes every prompt again in
+`__getitem__`. `TokenizedPromptDataset` reads a token store written once by
+`data/data_preprocess.py --token-store`:
+
+- `tokens.bin`: the prompt token ids of all rows back to back (int32)
+- `offsets.npy`: int64 row boundaries into `tokens.bin`, `num_rows + 1` entries
+- `rows.arrow`: every other column (messages, reward_model, data_task, ...) as an Arrow IPC file
+- `meta.json`: row count and the tokenizer the ids were made with
+
+All three are memory-mapped and opened lazily in each process, so workers share
+the page cache instead of copying the corpus, and a row is only decoded into
+Python objects when it is fetched. Use it through the `data.custom_cls` hook
+with `data.train_files` / `data.val_files` pointing at token store directories:
+
+    data.custom_cls.path=GRPO_Train/token_dataset.py data.custom_cls.name=TokenizedPromptDataset
+
+Items have the same keys as those of `RLHFDataset`, for text-only prompts.
+"""
+import json
+import os
+
+import numpy as np
+import pyarrow as pa
+import torch
+from torch.utils.data import Dataset
+
+TOKENS_FILE = 'tokens.bin'
+OFFSETS_FILE = 'offsets.npy'
+ROWS_FILE = 'rows.arrow'
+META_FILE = 'meta.json'
+
+
+def write_token_store(dataset, out_dir, ids_column='prompt_ids', tokenizer_name=None, batch_size=10000):
+    """Write a HF `datasets.Dataset` with a column of prompt token ids as a token store in `out_dir`."""
+    os.makedirs(out_dir, exist_ok=True)
+    dataset = dataset.flatten_indices()
+    offsets = [0]
+    with open(os.path.join(out_dir, TOKENS_FILE), 'wb') as f:
+        for batch in dataset.select_columns([ids_column]).iter(batch_size=batch_size):
+            for ids in batch[ids_column]:
+                np.asarray(ids, dtype=np.int32).tofile(f)
+                offsets.append(offsets[-1] + len(ids))
+    np.save(os.path.join(out_dir, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+
+    table = dataset.remove_columns([ids_column]).flatten_indices().data.table
+    with pa.OSFile(os.path.join(out_dir, ROWS_FILE), 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        for record_batch in table.to_batches(max_chunksize=batch_size):
+            writer.write_batch(record_batch)
+
+    with open(os.path.join(out_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'num_rows': len(dataset), 'num_tokens': offsets[-1], 'tokenizer': tokenizer_name}, f, ensure_ascii=False)
+
+
+class TokenStore():
+    """One token store directory, opened on first access in each process."""
+    def __init__(self, path) -> None:
+        self.path = path
+        with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.num_rows = self.meta['num_rows']
+        self._tokens = None
+        self._offsets = None
+        self._rows = None
+
+    def __getstate__(self):
+        # memory maps are reopened in the receiving process instead of being pickled by value
+        return {**self.__dict__, '_tokens': None, '_offsets': None, '_rows': None}
+
+    def _open(self):
+        if self._tokens is None:
+            self._offsets = np.load(os.path.join(self.path, OFFSETS_FILE), mmap_mode='r')
+            self._tokens = np.memmap(os.path.join(self.path, TOKENS_FILE), dtype=np.int32, mode='r')
+            self._rows = pa.ipc.open_file(pa.memory_map(os.path.join(self.path, ROWS_FILE))).read_all()
+
+    def lengths(self):
+        self._open()
+        return np.diff(self._offsets)
+
+    def token_ids(self, row):
+        self._open()
+        return self._tokens[self._offsets[row]:self._offsets[row + 1]]
+
+    def row(self, row):
+        self._open()
+        return self._rows.slice(row, 1).to_pylist()[0]
+
+    def column(self, name):
+        self._open()
+        return self._rows.column(name).to_pylist() if name in self._rows.column_names else None
+
+
+class TokenizedPromptDataset(Dataset):
+    def __init__(self, data_files, tokenizer, config, processor=None) -> None:
+        if isinstance(data_files, str):
+            data_files = [data_files]
+        self.tokenizer = tokenizer
+        self.prompt_key = config.get("prompt_key", "prompt")
+        self.max_prompt_length = config.get("max_prompt_length", 1024)
+        self.truncation = config.get("truncation", "error")
+        self.return_raw_chat = config.get("return_raw_chat", False)
+        self.return_full_prompt = config.get("return_full_prompt", False)
+        self.stores = [TokenStore(os.path.expanduser(path)) for path in data_files]
+
+        # (store, row) of every item; overlong prompts are filtered on the stored lengths, without tokenizing
+        store_ids, rows = [], []
+        for k, store in enumerate(self.stores):
+            keep = np.arange(store.num_rows)
+            if config.get("filter_overlong_prompts", True):
+                keep = np.nonzero(store.lengths() <= self.max_prompt_length)[0]
+            store_ids.append(np.full(len(keep), k, dtype=np.int32))
+            rows.append(keep.astype(np.int64))
+        self.store_ids = np.concatenate(store_ids) if store_ids else np.zeros(0, dtype=np.int32)
+        self.rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        print(f"{type(self).__name__}: {len(self)} of {sum(store.num_rows for store in self.stores)} prompts from {len(self.stores)} token stores")
+
+    def __len__(self):
+        return len(self.rows)
+
+    def prompt_lengths(self):
+        """Token count of every item, for `LengthBucketSampler`."""
+        lengths = np.concatenate([store.lengths() for store in self.stores])
+        starts = np.cumsum([0] + [store.num_rows for store in self.stores])[:-1]
+        return lengths[starts[self.store_ids] + self.rows].tolist()
+
+    def dataset_indices(self):
+        """`extra_info.index` of every item, for `SaturationAwareSampler`."""
+        infos = [store.column('extra_info') for store in self.stores]
+        return [((infos[k][row] if infos[k] is not None else None) or {}).get('index', position)
+                for position, (k, row) in enumerate(zip(self.store_ids, self.rows))]
+
+    def prompts(self):
+        """Prompt messages of every item, for `StreamingRewardScorer.index_prompts`."""
+        columns = [store.column(self.prompt_key) for store in self.stores]
+        return [columns[k][row] for k, row in zip(self.store_ids, self.rows)]
+
+    def raw_row(self, item):
+        """Stored columns of one item, without tokens."""
+        return self.stores[self.store_ids[item]].row(int(self.rows[item]))
+
+    def truncate(self, ids):
+        if len(ids) <= self.max_prompt_length:
+            return ids
+        if self.truncation == "left":
+            return ids[-self.max_prompt_length:]
+        if self.truncation == "right":
+            return ids[:self.max_prompt_length]
+        if self.truncation == "middle":
+            left_half = self.max_prompt_length // 2
+            right_half = self.max_prompt_length - left_half
+            return np.concatenate([ids[:left_half], ids[-right_half:]])
+        raise RuntimeError(f"Prompt length {len(ids)} is longer than {self.max_prompt_length}.")
+
+    def __getitem__(self, item):
+        store = self.stores[self.store_ids[item]]
+        row = int(self.rows[item])
+        row_dict = store.row(row)
+        messages = row_dict.pop(self.prompt_key)
+        ids = self.truncate(store.token_ids(row))
+
+        # left padding to max_prompt_length, like verl's postprocess_data
+        input_ids = torch.full((self.max_prompt_length,), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros(self.max_prompt_length, dtype=torch.long)
+        if len(ids):
+            input_ids[-len(ids):] = torch.from_numpy(np.asarray(ids, dtype=np.int64))
+            attention_mask[-len(ids):] = 1
+        row_dict["input_ids"] = input_ids
+        row_dict["attention_mask"] = attention_mask
+        row_dict["position_ids"] = torch.clip(torch.cumsum(attention_mask, dim=-1) - 1, min=0)
+        row_dict["raw_prompt_ids"] = [int(token) for token in ids]
+
+        if self.return_raw_chat:
+            row_dict["raw_prompt"] = messages
+        if self.return_full_prompt:
+            row_dict["full_prompts"] = self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+
+        extra_info = row_dict.get("extra_info") or {}
+        row_dict["index"] = extra_info.get("index", 0)
+        row_dict["tools_kwargs"] = extra_info.get("tools_kwargs", {})
+        row_dict["interaction_kwargs"] = extra_info.get("interaction_kwargs", {})
+        return row_dict
@@ -0,0 +1,97 @@
+"""Content-addressed cache for generative verifier judgments.
+
+The judge prompt fully determines the judgment (temperature 0), and it is built
+from (history, question, reference, prediction). Duplicate completions within a
+group and repeated prompts across epochs therefore hit the same key. The cache
+keeps an in-memory LRU tier in front of an optional sqlite file that survives
+restarts and can be shared by several processes.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class VerifierCache():
+    def __init__(self, max_entries=100000, path=None) -> None:
+        self.max_entries = max_entries
+        self.path = path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._last_stats = (0, 0, 0)
+
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS judgments (key TEXT PRIMARY KEY, answer TEXT)")
+            self._db.commit()
+
+    @staticmethod
+    def key(chat, model="WiNGPT-Verifier"):
+        payload = json.dumps([model, chat], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT answer FROM judgments WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.disk_hits += 1
+                    self._remember(key, row[0])
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, answer):
+        # empty replies are failed requests and must be retried next time
+        if not answer:
+            return
+        with self._lock:
+            self._remember(key, answer)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO judgments (key, answer) VALUES (?, ?)", (key, answer))
+                self._db.commit()
+
+    def _remember(self, key, answer):
+        self._memory[key] = answer
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'verifier_cache/hits': self.hits,
+                'verifier_cache/disk_hits': self.disk_hits,
+                'verifier_cache/misses': self.misses,
+                'verifier_cache/hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def pop_stats(self):
+        """Lookups since the last call, for per-step metrics."""
+        with self._lock:
+            totals = (self.hits, self.disk_hits, self.misses)
+            last, self._last_stats = self._last_stats, totals
+        return {
+            'verifier_cache/hits': totals[0] - last[0],
+            'verifier_cache/disk_hits': totals[1] - last[1],
+            'verifier_cache/misses': totals[2] - last[2],
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,99 @@
+"""Prefix-cache-aware ordering of judge requests.
+
+The rollouts of one prompt produce judge prompts that are identical up to the
+prediction: instructions, history, question and reference answer come first
+(see `verifier_template`). A judge server with prefix caching (vLLM/SGLang)
+only reuses that prefix if one request of the group has been prefilled before
+the others arrive. `PrefixAwareScheduler` therefore sends one leader per prompt
+group first, then the remaining requests of each group back to back, and can
+hold followers for `warmup` seconds after their leader went out so the
+leader's prefill finishes first.
+"""
+import asyncio
+import time
+
+import rewards
+from rewards import RULE_TASKS, verifier_template
+
+# rough chars per token of the judge tokenizer for mixed Chinese/English prompts
+CHARS_PER_TOKEN = 2.0
+
+
+def judge_prefix(messages, ground_truth):
+    """The part of the judge prompt shared by every rollout of a prompt."""
+    prompt_parts, _ = verifier_template(tuple((k['role'], k['content']) for k in messages), ground_truth, rewards.judge_template)
+    return prompt_parts[0]
+
+
+def needs_judge(item):
+    _, _, output, _, task, _, _ = item
+    # unfinished responses score 0.0 without a request
+    return task not in RULE_TASKS and output.endswith('<|im_end|>')
+
+
+class PrefixAwareScheduler():
+    def __init__(self, warmup=0.0, tokenizer=None, chars_per_token=CHARS_PER_TOKEN) -> None:
+        self.warmup = warmup
+        # counts prefix tokens exactly when the judge tokenizer is available, otherwise estimates from characters
+        self.tokenizer = tokenizer
+        self.chars_per_token = chars_per_token
+        self._leader_of = {}
+        self._started = {}
+
+    def count_tokens(self, text):
+        if self.tokenizer is not None and not isinstance(self.tokenizer, str):
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return int(len(text) / self.chars_per_token)
+
+    def order(self, items):
+        """Reorder decoded items: rule items, then one leader per prompt group, then the followers group by group.
+
+        Returns (ordered_items, stats) where stats estimates the prefix tokens
+        the judge server can serve from its prefix cache this step.
+        """
+        rule_items = []
+        groups = {}
+        for item in items:
+            if needs_judge(item):
+                groups.setdefault(judge_prefix(item[1], item[3]), []).append(item)
+            else:
+                rule_items.append(item)
+
+        leaders, followers = [], []
+        self._leader_of, self._started = {}, {}
+        tokens_saved = 0
+        for prefix, group in groups.items():
+            leaders.append(group[0])
+            followers.extend(group[1:])
+            for item in group[1:]:
+                self._leader_of[item[0]] = group[0][0]
+            if len(group) > 1:
+                tokens_saved += (len(group) - 1) * self.count_tokens(prefix)
+
+        stats = {
+            'reward/judge_prompt_groups': len(groups),
+            'reward/judge_requests': len(leaders) + len(followers),
+            'reward/judge_prefix_tokens_saved': tokens_saved,
+        }
+        return rule_items + leaders + followers, stats
+
+    def _delay(self, i):
+        leader = self._leader_of.get(i)
+        now = time.monotonic()
+        if leader is None:
+            self._started[i] = now
+            return 0.0
+        if self.warmup <= 0:
+            return 0.0
+        return self.warmup - (now - self._started.get(leader, now))
+
+    def wait(self, i):
+        """Call right before sending the request of row `i` (thread mode)."""
+        delay = self._delay(i)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def async_wait(self, i):
+        delay = self._delay(i)
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -4,6 +4,11 @@ set -xeuo pipefail
 project_name='verl_grpo_wingpt'
 exp_name='DAPO-Qwen3-8B'
 
+# parquet shards written by data/data_preprocess.py, overlong prompts are already filtered there
+DATA_DIR=/workspace/LLM-Train/LLM-RL/LLM-veRL/Model_Train_Data
+TRAIN_FILES=$(ls ${DATA_DIR}/train_grpo-*-of-*.parquet | paste -sd, -)
+VAL_FILES=$(ls ${DATA_DIR}/test_grpo-*-of-*.parquet | paste -sd, -)
+
 adv_estimator=grpo
 loss_agg_mode="token-mean"
 
@@ -43,8 +48,8 @@ infer_ppo_max_token_len=$(((max_prompt_length + max_response_length) * 2))
 offload=True
 
 python3 /workspace/LLM-Train/LLM-RL/LLM-veRL/Model_GRPO/main_dapo.py \
-    data.train_files=/workspace/LLM-Train/LLM-RL/LLM-veRL/Model_Train_Data/train_grpo.parquet \
-    data.val_files=/workspace/LLM-Train/LLM-RL/LLM-veRL/Model_Train_Data/test_grpo.parquet \
+    data.train_files="[${TRAIN_FILES}]" \
+    data.val_files="[${VAL_FILES}]" \
     data.prompt_key=prompt \
     data.truncation='left' \
     data.max_prompt_length=16384 \
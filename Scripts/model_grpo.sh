@@ -1,14 +1,19 @@
 set -x
 
+# parquet shards written by data/data_preprocess.py, overlong prompts are already filtered there
+DATA_DIR=/workspace/LLM-Train/LLM-RL/LLM-veRL/Model_Train_Data
+TRAIN_FILES=$(ls ${DATA_DIR}/train_grpo-*-of-*.parquet | paste -sd, -)
+VAL_FILES=$(ls ${DATA_DIR}/test_grpo-*-of-*.parquet | paste -sd, -)
+
 python3 /workspace/LLM-Train/LLM-RL/LLM-veRL/Model_GRPO/main_grpo.py \
     algorithm.adv_estimator=grpo \
-    data.train_files=/workspace/LLM-Train/LLM-RL/LLM-veRL/Model_Train_Data/train_grpo.parquet \
-    data.val_files=/workspace/LLM-Train/LLM-RL/LLM-veRL/Model_Train_Data/test_grpo.parquet \
+    data.train_files="[${TRAIN_FILES}]" \
+    data.val_files="[${VAL_FILES}]" \
     data.train_batch_size=256 \
     data.val_batch_size=256 \
     data.max_prompt_length=16384 \
     data.max_response_length=16384 \
-    data.filter_overlong_prompts=True \
+    data.filter_overlong_prompts=False \
     data.truncation='error' \
     actor_rollout_ref.model.path=/workspace/Model-HF/Model-SFT/30B-Instruct \
     actor_rollout_ref.actor.optim.lr=1e-6 \
@@ -0,0 +1,91 @@
+"""Import-time profile of the reward modules.
+
+Every module is imported in a fresh interpreter with `python -X importtime`, so
+each number is what a new reward worker process pays for it. Reports the
+cumulative import time of each module (median over `--repeat` runs), the
+heavy third-party packages it pulled in, and, with `--first-use`, the cost of
+the first math item that needs `math_verify`.
+
+    python benchmark/bench_imports.py --repeat 5 --top 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+GRPO_TRAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'GRPO_Train')
+
+MODULES = ['math_match', 'log_writer', 'verifier_cache', 'reward_model_api', 'rewards', 'task_scorers',
+           'verifier_scheduler', 'math_pool', 'streaming_rewards', 'reward_workers', 'RewardManager']
+# third-party packages worth watching, reported when a module pulls them in
+HEAVY_PACKAGES = ['math_verify', 'sympy', 'httpx', 'torch', 'verl', 'ray', 'numpy', 'transformers']
+
+FIRST_USE = """
+import time
+start = time.perf_counter()
+from rewards import get_reward
+imported = time.perf_counter()
+get_reward([{'role': 'user', 'content': 'q'}], r'\\boxed{x + 1}', r'\\boxed{1 + x}', 'math', None)
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def parse_importtime(stderr):
+    """{module: (self us, cumulative us)} of the top-level entry of every module in `-X importtime` output."""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def profile_module(module, env):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1]
+    return parse_importtime(result.stderr), None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', nargs='*', default=MODULES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5, help='largest imports listed per module')
+    parser.add_argument('--first-use', action='store_true', help='also time the first math_verify item')
+    args = parser.parse_args()
+
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join([GRPO_TRAIN, os.environ.get('PYTHONPATH', '')])}
+    print(f"{'module':<22}{'import ms':>12}{'self ms':>10}  heavy packages")
+    for module in args.modules:
+        runs, error = [], None
+        for _ in range(args.repeat):
+            times, error = profile_module(module, env)
+            if times is None:
+                break
+            runs.append(times)
+        if not runs:
+            print(f"{module:<22}{'failed':>12}  {error}")
+            continue
+        cumulative = statistics.median(run[module][1] for run in runs) / 1000
+        self_ms = statistics.median(run[module][0] for run in runs) / 1000
+        heavy = [package for package in HEAVY_PACKAGES if package in runs[-1]]
+        print(f"{module:<22}{cumulative:>12.1f}{self_ms:>10.1f}  {', '.join(heavy) or '-'}")
+        largest = sorted(((times[1], name) for name, times in runs[-1].items() if name not in (module, 'site', 'encodings') and '.' not in name), reverse=True)
+        for cumulative_us, name in largest[:args.top]:
+            print(f"{'':<4}{name:<18}{cumulative_us / 1000:>12.1f}")
+
+    if args.first_use:
+        result = subprocess.run([sys.executable, '-c', FIRST_USE], capture_output=True, text=True, env=env)
+        if result.returncode != 0:
+            print(f"first use failed: {result.stderr.strip().splitlines()[-1]}")
+        else:
+            imported, first_item = map(float, result.stdout.split())
+            print(f"import rewards {imported * 1000:.1f} ms, first math_verify item {first_item * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""Offline throughput benchmark of the reward manager.
+
+Builds `DataProto` batches, either synthetic (a configurable task mix) or
+replayed from reward logs (`*-model_verifier.json` / `*-log_train.json`,
+optionally compressed), and scores them with `MultiRewardManager` against the
+local stub judge of `stub_judge.py`. Every setting runs in a fresh process
+(the verifier pool, caches and log writers are process-wide) and reports
+items/sec, p50/p99 step reward latency, judge latency and peak RSS. Runs on a
+CPU-only box without network; decoding uses a byte-level stand-in tokenizer.
+
+    python benchmark/bench_reward_manager.py --mix general=0.6,choice=0.2,math=0.1,quality-control=0.1 \\
+        --setting verifier_mode=thread \\
+        --setting verifier_mode=async,verifier_max_in_flight=512 \\
+        --setting verifier_mode=async,verifier_batch_size=8
+    python benchmark/bench_reward_manager.py --replay log_date/20250801-model_verifier.json --latency-ms 800
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+import torch
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'GRPO_Train'))
+sys.path.insert(0, BENCH_DIR)
+
+
+class ByteTokenizer():
+    """Stand-in tokenizer: one token per UTF-8 byte, so no tokenizer files are needed."""
+    def encode(self, text, add_special_tokens=False):
+        return list(text.encode('utf-8'))
+
+    def batch_decode(self, sequences, skip_special_tokens=False):
+        return [bytes(ids).decode('utf-8', errors='ignore') for ids in sequences]
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        text = ''.join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages)
+        return text + '<|im_start|>assistant\n' if add_generation_prompt else text
+
+
+def synthetic_output(task, k, rng, response_chars):
+    body = f'<think>\n第{k}种思路：' + '推理步骤' * (response_chars // 8) + '\n</think>\n'
+    if task == 'choice':
+        return body + f"答案是 \\boxed{{{rng.choice('ABCD')}}}"
+    if task == 'quality-control':
+        return body + ' '.join(rng.choice(['true', 'false']) for _ in range(3))
+    if task == 'math':
+        return body + f'\\boxed{{{rng.choice([42, 41, "42.0", "84/2"])}}}'
+    if task == 'MedCalc-Bench':
+        return body + f'\\boxed{{{rng.uniform(2.5, 4.5):.2f}}}'
+    return body + '综合以上分析，' + '建议如下' * (response_chars // 8)
+
+
+def synthetic_groups(num_groups, rollouts, mix, history_turns, turn_chars, response_chars,
+                     dup_rate=0.1, unfinished_rate=0.05, seed=0):
+    """[(messages, ground_truth, task, limit, [output, ...]), ...] for `num_groups` prompts."""
+    rng = random.Random(seed)
+    tasks, weights = zip(*mix.items())
+    targets = {'choice': '\\boxed{B}', 'quality-control': 'true false true', 'math': '$42$', 'MedCalc-Bench': '3.5'}
+    groups = []
+    for g in range(num_groups):
+        task = rng.choices(tasks, weights)[0]
+        messages = []
+        for turn in range(rng.randint(0, history_turns)):
+            messages.append({'role': 'user', 'content': f'第{g}-{turn}轮问题：' + '症状描述' * (turn_chars // 4)})
+            messages.append({'role': 'assistant', 'content': f'第{g}-{turn}轮回答：' + '建议检查' * (turn_chars // 4)})
+        messages.append({'role': 'user', 'content': f'问题{g}：请给出结论。'})
+        outputs = []
+        for k in range(rollouts):
+            if outputs and rng.random() < dup_rate:
+                output = rng.choice(outputs)
+            else:
+                output = synthetic_output(task, k, rng, response_chars)
+                if rng.random() >= unfinished_rate:
+                    output += '<|im_end|>'
+            outputs.append(output)
+        ground_truth = targets.get(task, '参考答案：' + '优秀回答' * (response_chars // 8))
+        groups.append((messages, ground_truth, task, [3.0, 4.0], outputs))
+    return groups
+
+
+def replay_groups(path, rollouts, num_groups):
+    """Prompt groups from a reward log.
+
+    `*-model_verifier.json` records hold one judged output each and are grouped
+    by question and reference answer. `*-log_train.json` only keeps the best
+    completion of a question, which is repeated once per recorded score.
+    """
+    from log_writer import open_log
+
+    records = OrderedDict()
+    with open_log(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            key = (record['question'], record['solution'])
+            if 'output' in record:
+                records.setdefault(key, []).append(record['output'] + '<|im_end|>')
+            else:
+                records.setdefault(key, []).extend([record['completion']] * len(record['reward_score']))
+            if len(records) > num_groups:
+                break
+
+    groups = []
+    for (question, solution), outputs in list(records.items())[:num_groups]:
+        outputs = [outputs[k % len(outputs)] for k in range(rollouts)]
+        groups.append(([{'role': 'user', 'content': question}], solution, 'general', [0.0, 0.0], outputs))
+    return groups
+
+
+def object_array(values):
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
+def build_batch(groups, tokenizer, response_length, prompt_length=16):
+    from verl import DataProto
+
+    rows = [(g, group, output) for g, group in enumerate(groups) for output in group[4]]
+    responses = torch.zeros(len(rows), response_length, dtype=torch.long)
+    attention_mask = torch.zeros(len(rows), prompt_length + response_length, dtype=torch.long)
+    attention_mask[:, :prompt_length] = 1
+    for row, (_, _, output) in enumerate(rows):
+        ids = tokenizer.encode(output)
+        if len(ids) > response_length:
+            # keep the end of the response (`<|im_end|>`)
+            ids = ids[-response_length:]
+        responses[row, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+        attention_mask[row, prompt_length:prompt_length + len(ids)] = 1
+
+    return DataProto.from_dict(
+        tensors={'prompts': torch.zeros(len(rows), prompt_length, dtype=torch.long),
+                 'responses': responses,
+                 'attention_mask': attention_mask},
+        non_tensors={'messages': object_array([group[0] for _, group, _ in rows]),
+                     'reward_model': object_array([{'style': 'rule', 'ground_truth': group[1]} for _, group, _ in rows]),
+                     'data_task': object_array([group[2] for _, group, _ in rows]),
+                     'limits': object_array([group[3] for _, group, _ in rows]),
+                     'uid': object_array([str(g) for g, _, _ in rows])})
+
+
+def parse_setting(text):
+    """'verifier_mode=async,verifier_max_in_flight=512' -> manager kwargs."""
+    setting = {}
+    for pair in filter(None, text.split(',')):
+        key, value = pair.split('=', 1)
+        try:
+            setting[key] = json.loads(value)
+        except json.JSONDecodeError:
+            setting[key] = value
+    return setting
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def run_setting(setting, args):
+    """Score `args['steps']` batches with one manager configuration, in its own process."""
+    os.environ['NO_PROXY'] = os.environ['no_proxy'] = '127.0.0.1,localhost'
+    import stub_judge
+    from RewardManager import MultiRewardManager
+
+    server, url = stub_judge.serve(latency_ms=args['latency_ms'], latency_dist=args['latency_dist'],
+                                   failure_rate=args['failure_rate'], hang_rate=args['hang_rate'],
+                                   hang_s=args['hang_s'], reply_chars=args['reply_chars'], seed=args['seed'])
+    tokenizer = ByteTokenizer()
+    kwargs = dict(verifier_urls=[url], log_dir=tempfile.mkdtemp(prefix='bench_reward_logs_'))
+    if setting.get('verifier_batch_size', 1) > 1:
+        kwargs['verifier_tokenizer'] = tokenizer
+    kwargs.update(setting)
+    manager = MultiRewardManager(tokenizer=tokenizer, num_examine=0, **kwargs)
+
+    batches = []
+    replayed = replay_groups(args['replay'], args['rollouts'], args['prompts']) if args['replay'] else None
+    for step in range(args['warmup'] + args['steps']):
+        if replayed is not None:
+            groups = replayed
+        else:
+            groups = synthetic_groups(args['prompts'], args['rollouts'], args['mix'], args['history_turns'],
+                                      args['turn_chars'], args['response_chars'], seed=args['seed'] + step)
+        batches.append(build_batch(groups, tokenizer, args['response_length']))
+
+    step_times, metrics, errors = [], {}, 0
+    for step, batch in enumerate(batches):
+        start = time.perf_counter()
+        manager(batch)
+        elapsed = time.perf_counter() - start
+        step_metrics = manager.pop_metrics()
+        if step >= args['warmup']:
+            step_times.append(elapsed)
+            metrics = step_metrics
+            errors += step_metrics.get('judge/errors', 0)
+    server.shutdown()
+
+    items = sum(len(batch) for batch in batches[args['warmup']:])
+    return {
+        'setting': setting,
+        'items_per_s': items / sum(step_times),
+        'step_p50_s': percentile(step_times, 0.5),
+        'step_p99_s': percentile(step_times, 0.99),
+        'judge_p50_s': metrics.get('judge/latency_p50', 0.0),
+        'judge_p99_s': metrics.get('judge/latency_p99', 0.0),
+        'peak_in_flight': metrics.get('judge/peak_in_flight', 0),
+        'judge_errors': errors,
+        # ru_maxrss is in KiB on Linux; the math pool's worker processes are not included
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--setting', action='append', default=None,
+                        help='manager kwargs as key=value,key=value; repeat to compare settings')
+    parser.add_argument('--mix', default='general=0.6,choice=0.2,math=0.1,quality-control=0.1',
+                        help='task weights of the synthetic batches')
+    parser.add_argument('--replay', default=None, help='build batches from a model_verifier / log_train reward log')
+    parser.add_argument('--prompts', type=int, default=64, help='prompt groups per step')
+    parser.add_argument('--rollouts', type=int, default=12)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--history-turns', type=int, default=4)
+    parser.add_argument('--turn-chars', type=int, default=400)
+    parser.add_argument('--response-chars', type=int, default=1200)
+    parser.add_argument('--response-length', type=int, default=8192, help='response tokens (bytes) per row')
+    parser.add_argument('--latency-ms', type=float, default=500.0)
+    parser.add_argument('--latency-dist', default='lognormal', choices=['fixed', 'exp', 'lognormal'])
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--hang-rate', type=float, default=0.0)
+    parser.add_argument('--hang-s', type=float, default=30.0)
+    parser.add_argument('--reply-chars', type=int, default=1500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='write the results as json')
+    args = parser.parse_args()
+
+    settings = [parse_setting(text) for text in (args.setting or ['verifier_mode=thread', 'verifier_mode=async'])]
+    config = vars(args)
+    config['mix'] = {task: float(weight) for task, weight in (pair.split('=') for pair in args.mix.split(','))}
+
+    results, failed = [], []
+    print(f"{'setting':<60} {'items/s':>9} {'step p50':>9} {'step p99':>9} {'judge p50':>10} {'judge p99':>10} {'rss MB':>8}")
+    for setting in settings:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            result = executor.submit(run_setting, setting, config).result()
+        results.append(result)
+        name = ','.join(f'{key}={value}' for key, value in setting.items())
+        print(f"{name:<60} {result['items_per_s']:9.1f} {result['step_p50_s']:9.2f} {result['step_p99_s']:9.2f} "
+              f"{result['judge_p50_s']:10.3f} {result['judge_p99_s']:10.3f} {result['peak_rss_mb']:8.0f}")
+        # without injected failures every error is the harness's (dropped connections), not the manager's
+        if args.failure_rate == 0 and args.hang_rate == 0 and result['judge_errors']:
+            failed.append(name)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if failed:
+        sys.exit(f"judge errors without injected failures in: {', '.join(failed)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Micro-benchmark: per-item CPU cost of the rule checks and judge prompt construction.
+
+Compares the previous implementation (module-level `re` calls, four chained
+`str.replace` over the full verifier prompt per rollout) with the precompiled
+patterns and per-prompt verifier templates in `rewards.py`.
+
+    python benchmark/bench_rules.py --rollouts 12 --history-turns 8
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'GRPO_Train'))
+import rewards  # noqa: E402
+
+
+def legacy_build_prompt(message, output, target):
+    prompt = rewards.verifier_prompt.strip()
+    if len(message)>=3:
+        history  = '\n'.join([k['role']+'：'+k['content'].strip() for k in message[:-1]])
+        prompt = prompt.replace('{插入对话历史}', history)
+        question = 'user：' + message[-1]['content'].strip()
+    else:
+        prompt = prompt.replace('{插入对话历史}', '无')
+        question = '\n'.join([k['role']+'：'+k['content'].strip() for k in message])
+    prompt = prompt.replace('{插入原始问题}', question.strip())
+    prompt = prompt.replace('{插入优秀答案}', target.strip())
+    prompt = prompt.replace('{插入待评估答案}', output.strip())
+    return [{"role": "user", "content": prompt}], question
+
+
+def legacy_choice(output, target):
+    matches_text1 = re.findall(r'\\boxed\{(?:\\text\{)?([ABCDEFG])(?:\..*)?(?:\})?\}', output)
+    matches_text2 = re.findall(r'\\boxed\{(?:\\text\{)?([ABCDEFG])(?:\..*)?(?:\})?\}', target)
+    return 1.0 if matches_text1 == matches_text2 else 0.0
+
+
+def legacy_quality_control(output, target):
+    return 1.0 if re.findall(r'(true|false)', output) == re.findall(r'(true|false)', target) else 0.0
+
+
+def legacy_extract_score(response):
+    boxes = re.findall(r'\\boxed\{([^}]*)\}', response)
+    if not boxes:
+        return 0.0
+    score_match = re.search(r'(\d{1,3}(?:\.\d{1,2})?)\s*(?:分)?\b', boxes[-1].strip())
+    return float(score_match.group(1)) / 100.0 if score_match else 0.0
+
+
+def make_group(g, rollouts, history_turns, turn_chars):
+    # every group has its own history and target, so the per-prompt caches only hit within a group
+    message = []
+    for turn in range(history_turns):
+        message.append({'role': 'user', 'content': f'第{g}-{turn}轮问题：' + '症状描述' * (turn_chars // 4)})
+        message.append({'role': 'assistant', 'content': f'第{g}-{turn}轮回答：' + '建议检查' * (turn_chars // 4)})
+    message.append({'role': 'user', 'content': f'问题{g}：请给出最终诊断。'})
+    target = f'参考答案{g}：' + '综合分析' * 200 + '\\boxed{B}' + ' true false true'
+    outputs = [f'<think>\n分析{k}\n</think>\n' + '推理过程' * 300 + '\\boxed{B}' + ' true false' for k in range(rollouts)]
+    judge_reply = '### 📊 评估分析\n' + '对比' * 500 + '\n\\boxed{85}'
+    return message, target, outputs, judge_reply
+
+
+def bench(name, fn, groups, repeat):
+    items = sum(len(outputs) for _, _, outputs, _ in groups) * repeat
+    start = time.process_time()
+    for _ in range(repeat):
+        # a repeat must not reuse the templates of the previous one
+        rewards.verifier_template.cache_clear()
+        rewards.target_matches.cache_clear()
+        for message, target, outputs, judge_reply in groups:
+            for output in outputs:
+                fn(message, output, target, judge_reply)
+    elapsed = time.process_time() - start
+    print(f'{name:<28} {elapsed / items * 1e6:10.2f} us/item')
+    return elapsed / items
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--groups', type=int, default=64)
+    parser.add_argument('--rollouts', type=int, default=12)
+    parser.add_argument('--history-turns', type=int, default=8)
+    parser.add_argument('--turn-chars', type=int, default=800)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    groups = [make_group(g, args.rollouts, args.history_turns, args.turn_chars) for g in range(args.groups)]
+
+    cases = [
+        ('judge prompt', 
+         lambda m, o, t, r: legacy_build_prompt(m, o, t), 
+         lambda m, o, t, r: rewards.build_verifier_chat(m, o, t)),
+        ('choice rule', 
+         lambda m, o, t, r: legacy_choice(o, t), 
+         lambda m, o, t, r: rewards.get_reward(m, o, t, 'choice', None)),
+        ('quality-control rule', 
+         lambda m, o, t, r: legacy_quality_control(o, t), 
+         lambda m, o, t, r: rewards.get_reward(m, o, t, 'quality-control', None)),
+        ('judge score extraction', 
+         lambda m, o, t, r: legacy_extract_score(r), 
+         lambda m, o, t, r: rewards.extract_evaluation_score(r)),
+    ]
+    for name, legacy, current in cases:
+        before = bench(f'{name} (before)', legacy, groups, args.repeat)
+        after = bench(f'{name} (after)', current, groups, args.repeat)
+        print(f'{name:<28} {before / after:10.2f} x\n')
+
+
+if __name__ == '__main__':
+    main()
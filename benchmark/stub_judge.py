@@ -0,0 +1,188 @@
+"""Local OpenAI-compatible stub of the judge server for offline benchmarks.
+
+Serves `/v1/chat/completions` (plain and `stream=True`), `/v1/completions`
+(a list of prompts per request) and `/health` with the standard library only,
+so reward-manager benchmarks run on a CPU box without network or GPUs.
+Latency is drawn per request from a fixed, exponential or lognormal
+distribution, and a share of requests can fail with 503 or hang.
+
+    python benchmark/stub_judge.py --port 8000 --latency-ms 800 --latency-dist lognormal --failure-rate 0.01
+
+Replies look like the real judge: an analysis followed by the boxed score, or
+the score first when the prompt asks for it (`verifier_prompt_variant='score_first'`).
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubJudgeConfig():
+    def __init__(self,
+                 latency_ms=500.0,
+                 latency_dist='lognormal',
+                 latency_sigma=0.5,
+                 batch_cost=0.1,
+                 failure_rate=0.0,
+                 hang_rate=0.0,
+                 hang_s=30.0,
+                 reply_chars=1500,
+                 stream_chunks=50,
+                 seed=0) -> None:
+        assert latency_dist in ['fixed', 'exp', 'lognormal'], f"unknown {latency_dist=}"
+        self.latency_ms = latency_ms
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        # every extra prompt of a /v1/completions request adds this fraction of one request's latency
+        self.batch_cost = batch_cost
+        self.failure_rate = failure_rate
+        self.hang_rate = hang_rate
+        self.hang_s = hang_s
+        self.reply_chars = reply_chars
+        self.stream_chunks = stream_chunks
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def sample_latency(self):
+        mean = self.latency_ms / 1000.0
+        with self.lock:
+            if self.latency_dist == 'fixed':
+                return mean
+            if self.latency_dist == 'exp':
+                return self.random.expovariate(1.0 / mean)
+            # lognormal with the given mean
+            return self.random.lognormvariate(0.0, self.latency_sigma) * mean / math.exp(self.latency_sigma ** 2 / 2)
+
+    def sample_outcome(self):
+        """'ok', 'fail' (503) or 'hang'."""
+        with self.lock:
+            r = self.random.random()
+        if r < self.failure_rate:
+            return 'fail'
+        if r < self.failure_rate + self.hang_rate:
+            return 'hang'
+        return 'ok'
+
+    def reply(self, prompt):
+        with self.lock:
+            score = self.random.randint(30, 100)
+        analysis = '### 📊 评估分析\n\n' + ('对比优秀答案与预测答案，' * (self.reply_chars // 12 + 1))[:self.reply_chars]
+        score_part = f'### 📌 预测答案评估分数\n\n\\boxed{{{score}}}\n\n---'
+        if '先给出评估分数' in prompt:
+            return score_part + '\n\n' + analysis + '\n\n---'
+        return analysis + '\n\n---\n\n' + score_part
+
+
+class StubJudgeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        outcome = self.config.sample_outcome()
+        if outcome == 'fail':
+            self._send_json(503, {'error': 'stub failure'})
+            return
+        if outcome == 'hang':
+            time.sleep(self.config.hang_s)
+
+        if self.path == '/v1/chat/completions':
+            prompt = payload['messages'][-1]['content']
+            reply = self.config.reply(prompt)
+            if payload.get('stream'):
+                self._stream(reply, self.config.sample_latency())
+                return
+            time.sleep(self.config.sample_latency())
+            self._send_json(200, {'object': 'chat.completion',
+                                  'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply}, 'finish_reason': 'stop'}]})
+        elif self.path == '/v1/completions':
+            prompts = payload['prompt'] if isinstance(payload['prompt'], list) else [payload['prompt']]
+            time.sleep(self.config.sample_latency() * (1 + self.config.batch_cost * (len(prompts) - 1)))
+            self._send_json(200, {'object': 'text_completion',
+                                  'choices': [{'index': k, 'text': self.config.reply(prompt), 'finish_reason': 'stop'}
+                                              for k, prompt in enumerate(prompts)]})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def _stream(self, reply, latency):
+        """Send `reply` as server-sent events spread over `latency` seconds, like token-by-token decoding."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        size = max(1, -(-len(reply) // self.config.stream_chunks))
+        try:
+            for start in range(0, len(reply), size):
+                time.sleep(latency / self.config.stream_chunks)
+                chunk = {'object': 'chat.completion.chunk', 'choices': [{'index': 0, 'delta': {'content': reply[start:start + size]}}]}
+                self.wfile.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+            self.wfile.write(b'data: [DONE]\n\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # the client stopped reading once it had the score
+            pass
+
+
+class StubJudgeServer(ThreadingHTTPServer):
+    # the default listen backlog of 5 drops connections when the async client opens hundreds at once
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def serve(host='127.0.0.1', port=0, **config):
+    """Start the stub in a daemon thread, returns (server, chat completions URL)."""
+    handler = type('ConfiguredStubJudgeHandler', (StubJudgeHandler,), {'config': StubJudgeConfig(**config)})
+    server = StubJudgeServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='stub-judge', daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}/v1/chat/completions'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency-ms', type=float, default=500.0)
+    parser.add_argument('--latency-dist', default='lognormal', choices=['fixed', 'exp', 'lognormal'])
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--batch-cost', type=float, default=0.1)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--hang-rate', type=float, default=0.0)
+    parser.add_argument('--hang-s', type=float, default=30.0)
+    parser.add_argument('--reply-chars', type=int, default=1500)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server, url = serve(args.host, args.port, latency_ms=args.latency_ms, latency_dist=args.latency_dist,
+                        latency_sigma=args.latency_sigma, batch_cost=args.batch_cost, failure_rate=args.failure_rate,
+                        hang_rate=args.hang_rate, hang_s=args.hang_s, reply_chars=args.reply_chars, seed=args.seed)
+    print(f'stub judge listening on {url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
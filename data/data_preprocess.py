@@ -1,7 +1,21 @@
 """
-Preprocess dataset for countdown task - given a target number and N numbers, generate equations to reach target
+Preprocess the training / test JSONL into the parquet files read by main_grpo.py / main_dapo.py
+
+    python data/data_preprocess.py --tokenizer /workspace/Model-HF/Model-SFT/30B-Instruct --max-prompt-length 16384 --num-proc 32
+
+Prompts are rendered with the chat template and tokenized once here, in `--num-proc`
+processes: the token count is stored in a `prompt_length` column and prompts longer
+than `--max-prompt-length` are dropped, so the trainer can run with
+`data.filter_overlong_prompts=False` instead of tokenizing the whole corpus at every
+startup. The output is written as `--num-shards` parquet shards per split.
 """
+import argparse
+import glob
 import os
+import sys
+
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
 from datasets import load_dataset
 
 '''
@@ -12,14 +26,6 @@ task表示任务名称，不同任务采用不同的奖励方法
 limits表示区间范围，有些任务答案在范围内都算正确
 '''
 
-# Load the dataset
-dataset = load_dataset("json", data_files='/workspace/LLM-Train/LLM-RL/LLM-veRL/data/20250809.jsonl', split="train", cache_dir="/workspace/cache_dir/")
-testdata_set = load_dataset("json", data_files='/workspace/LLM-Train/LLM-RL/LLM-veRL/data/Model_Test.jsonl', split="train", cache_dir="/workspace/cache_dir/")
-
-# 打乱数据集，注意设置一个种子值以确保结果可重复
-shuffled_traindataset = dataset.shuffle(seed=42)
-shuffled_testdataset = testdata_set.shuffle(seed=42)
-  
 def make_map_fn(split):
     def process_fn(example, idx):
         data = {
@@ -37,14 +43,90 @@ def make_map_fn(split):
         return data
     return process_fn
 
-local_dir = '/workspace/LLM-Train/LLM-RL/LLM-veRL/Model_Train_Data'
 
-train_dataset = shuffled_traindataset.map(function=make_map_fn('train'), with_indices=True)
-train_dataset.to_parquet(os.path.join(local_dir, 'train_grpo.parquet'))
-print(len(train_dataset))
-print(train_dataset[0])
+def make_length_fn(tokenizer, keep_ids=False):
+    # the prompt ids RLHFDataset feeds the model, their count is what filter_overlong_prompts checks
+    def length_fn(batch):
+        prompt_ids = [tokenizer.encode(tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False),
+                                       add_special_tokens=False)
+                      for messages in batch["prompt"]]
+        data = {"prompt_length": [len(ids) for ids in prompt_ids]}
+        if keep_ids:
+            data["prompt_ids"] = prompt_ids
+        return data
+    return length_fn
+
+
+def write_shards(dataset, local_dir, name, num_shards):
+    """Write `{name}-00000-of-0000N.parquet` shards, removing the shards of an earlier run first."""
+    for path in glob.glob(os.path.join(local_dir, f'{name}-*-of-*.parquet')):
+        os.remove(path)
+    num_shards = max(1, min(num_shards, len(dataset)))
+    paths = []
+    for index in range(num_shards):
+        path = os.path.join(local_dir, f'{name}-{index:05d}-of-{num_shards:05d}.parquet')
+        dataset.shard(num_shards=num_shards, index=index, contiguous=True).to_parquet(path)
+        paths.append(path)
+    return paths
+
+
+def preprocess(data_file, split, name, args, tokenizer):
+    if args.dedup:
+        # exact and MinHash near-duplicate prompts, report in {name}-dedup.jsonl.report.json
+        from prompt_dedup import deduplicate
+        deduped_file = os.path.join(args.local_dir, f'{name}-dedup.jsonl')
+        deduplicate(data_file, deduped_file, threshold=args.dedup_threshold, num_proc=args.num_proc, seed=args.seed)
+        data_file = deduped_file
+
+    dataset = load_dataset("json", data_files=data_file, split="train", cache_dir=args.cache_dir)
+    # 打乱数据集，注意设置一个种子值以确保结果可重复
+    dataset = dataset.shuffle(seed=args.seed)
+    dataset = dataset.map(function=make_map_fn(split), with_indices=True, num_proc=args.num_proc)
+
+    dataset = dataset.map(make_length_fn(tokenizer, keep_ids=args.token_store), batched=True, batch_size=1000, num_proc=args.num_proc)
+    num_rows = len(dataset)
+    dataset = dataset.filter(lambda lengths: [length <= args.max_prompt_length for length in lengths],
+                             input_columns="prompt_length", batched=True, batch_size=10000, num_proc=args.num_proc)
+    print(f"{split}: dropped {num_rows - len(dataset)} of {num_rows} prompts longer than {args.max_prompt_length} tokens")
+
+    if args.token_store:
+        # memory-mapped token ids for GRPO_Train/token_dataset.py, the parquet shards stay without them
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'GRPO_Train'))
+        from token_dataset import write_token_store
+        write_token_store(dataset, os.path.join(args.local_dir, f'{name}_tokens'), tokenizer_name=args.tokenizer)
+        dataset = dataset.remove_columns("prompt_ids")
+
+    paths = write_shards(dataset, args.local_dir, name, args.num_shards)
+    print(len(dataset))
+    print(dataset[0])
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--train-file', default='/workspace/LLM-Train/LLM-RL/LLM-veRL/data/20250809.jsonl')
+    parser.add_argument('--test-file', default='/workspace/LLM-Train/LLM-RL/LLM-veRL/data/Model_Test.jsonl')
+    parser.add_argument('--local-dir', default='/workspace/LLM-Train/LLM-RL/LLM-veRL/Model_Train_Data')
+    parser.add_argument('--cache-dir', default='/workspace/cache_dir/')
+    # required: the training scripts run with data.filter_overlong_prompts=False and rely on the filtering here
+    parser.add_argument('--tokenizer', required=True, help='tokenizer of the policy model (actor_rollout_ref.model.path)')
+    parser.add_argument('--max-prompt-length', type=int, default=16384, help='data.max_prompt_length of the training run')
+    parser.add_argument('--num-proc', type=int, default=os.cpu_count())
+    parser.add_argument('--num-shards', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--dedup', action='store_true', help='remove exact and near-duplicate prompts first, see prompt_dedup.py')
+    parser.add_argument('--dedup-threshold', type=float, default=0.85)
+    parser.add_argument('--token-store', action='store_true', help='also write {name}_tokens/ for TokenizedPromptDataset')
+    args = parser.parse_args()
+
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, trust_remote_code=True)
+
+    os.makedirs(args.local_dir, exist_ok=True)
+    for data_file, split, name in [(args.train_file, 'train', 'train_grpo'), (args.test_file, 'test', 'test_grpo')]:
+        paths = preprocess(data_file, split, name, args, tokenizer)
+        print(f"data.{split if split == 'train' else 'val'}_files=[{','.join(paths)}]")
+
 
-test_dataset = shuffled_testdataset.map(function=make_map_fn('test'), with_indices=True)
-test_dataset.to_parquet(os.path.join(local_dir, 'test_grpo.parquet'))
-print(len(test_dataset))
-print(test_dataset[0])
+if __name__ == '__main__':
+    main()
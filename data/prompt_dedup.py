@@ -0,0 +1,228 @@
+"""
+Exact and near-duplicate prompt removal for the training JSONL
+
+    python data/prompt_dedup.py data/20250809.jsonl data/20250809-dedup.jsonl --threshold 0.85 --num-proc 32
+
+The text of a record is all message contents of its `messages`, NFKC-normalized,
+lowercased, with punctuation and repeated whitespace removed. Its answer is the
+`task` and the `solution` (NFKC-normalized whitespace, punctuation and case
+kept, so "-3" and "3" differ): prompts that only look alike but are scored
+differently are not duplicates.
+
+1. exact: records with the same answer and normalized text (64-bit blake2b) keep
+   the first one
+2. near: MinHash signatures over character n-grams, LSH banding to find candidate
+   pairs among records with the same answer, and a pair is a duplicate when the
+   estimated Jaccard similarity is at least `--threshold`; every cluster keeps
+   its first record
+
+The input is streamed twice (signatures, then writing) and signatures are computed
+in `--num-proc` processes, so memory grows with the number of records times
+`--num-perm` 4-byte values rather than with the text. Removed records go to
+`<output>.removed.jsonl` with what they duplicate, and `<output>.report.json`
+counts total / exact / near / kept per task.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import unicodedata
+import zlib
+from collections import Counter, defaultdict
+from itertools import islice
+from multiprocessing import Pool
+
+import numpy as np
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+_PUNCT_PATTERN = re.compile(r'[^\w\s]+')
+
+_permutations = None
+
+
+def record_text(record):
+    messages = record.get('messages') or []
+    return '\n'.join(message['content'] for message in messages if isinstance(message.get('content'), str))
+
+
+def normalize_text(text):
+    text = unicodedata.normalize('NFKC', text).lower()
+    return ' '.join(_PUNCT_PATTERN.sub(' ', text).split())
+
+
+def normalize_solution(solution):
+    return ' '.join(unicodedata.normalize('NFKC', '' if solution is None else str(solution)).split())
+
+
+def exact_key(*parts):
+    text = '\x00'.join(parts)
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def make_permutations(num_perm, seed):
+    generator = np.random.RandomState(seed)
+    a = generator.randint(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+    b = generator.randint(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash(text, a, b, ngram):
+    """MinHash signature (num_perm uint32) of the character n-grams of `text`."""
+    shingles = {text[i:i + ngram] for i in range(max(1, len(text) - ngram + 1))}
+    hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    # uint64 products wrap around, as in datasketch
+    return (((np.outer(a, hashes) + b[:, None]) % MERSENNE_PRIME) & MAX_HASH).min(axis=1).astype(np.uint32)
+
+
+def _init_worker(num_perm, seed, ngram):
+    global _permutations
+    _permutations = make_permutations(num_perm, seed) + (ngram,)
+
+
+def _signature_chunk(lines):
+    a, b, ngram = _permutations
+    keys, answers, signatures, tasks = [], [], [], []
+    for line in lines:
+        record = json.loads(line)
+        text = normalize_text(record_text(record))
+        answer = exact_key(str(record.get('task')), normalize_solution(record.get('solution')))
+        keys.append(exact_key(str(answer), text))
+        answers.append(answer)
+        signatures.append(minhash(text, a, b, ngram))
+        tasks.append(record.get('task'))
+    return (np.asarray(keys, dtype=np.uint64), np.asarray(answers, dtype=np.uint64),
+            np.stack(signatures) if signatures else None, tasks)
+
+
+def read_chunks(path, chunk_size):
+    with open(path, encoding='utf-8') as f:
+        lines = (line for line in f if line.strip())
+        while True:
+            chunk = list(islice(lines, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def compute_signatures(path, num_perm, seed, ngram, num_proc, chunk_size=1000):
+    keys, answers, signatures, tasks = [], [], [], []
+    with Pool(num_proc, initializer=_init_worker, initargs=(num_perm, seed, ngram)) as pool:
+        for chunk_keys, chunk_answers, chunk_signatures, chunk_tasks in pool.imap(_signature_chunk, read_chunks(path, chunk_size)):
+            keys.append(chunk_keys)
+            answers.append(chunk_answers)
+            signatures.append(chunk_signatures)
+            tasks.extend(chunk_tasks)
+    if not keys:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64), np.zeros((0, num_perm), dtype=np.uint32), []
+    return np.concatenate(keys), np.concatenate(answers), np.concatenate(signatures), tasks
+
+
+class UnionFind():
+    """Union-find whose roots are the smallest (first) member of every set."""
+    def __init__(self, size) -> None:
+        self.parent = np.arange(size)
+
+    def find(self, x):
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, x, y):
+        x, y = self.find(x), self.find(y)
+        if x != y:
+            self.parent[max(x, y)] = min(x, y)
+
+
+def near_duplicate_roots(signatures, answers, bands, threshold, seed):
+    """Root (first similar record with the same answer) of every row of `signatures`, found with LSH banding."""
+    num_rows, num_perm = signatures.shape
+    rows_per_band = num_perm // bands
+    multipliers = np.random.RandomState(seed + 1).randint(1, 1 << 62, size=rows_per_band, dtype=np.uint64) | np.uint64(1)
+    union_find = UnionFind(num_rows)
+    order_ids = np.arange(num_rows)
+    for band in range(bands):
+        band_values = signatures[:, band * rows_per_band:(band + 1) * rows_per_band].astype(np.uint64)
+        # records with different answers never share a bucket
+        band_keys = (band_values * multipliers).sum(axis=1) ^ answers
+        order = np.lexsort((order_ids, band_keys))
+        sorted_keys = band_keys[order]
+        is_start = np.ones(num_rows, dtype=bool)
+        is_start[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        # every member of a bucket is compared with the first record of the bucket
+        heads = order[np.maximum.accumulate(np.where(is_start, np.arange(num_rows), 0))]
+        members = np.nonzero(~is_start)[0]
+        if not len(members):
+            continue
+        candidates, candidate_heads = order[members], heads[members]
+        similarity = (signatures[candidates] == signatures[candidate_heads]).mean(axis=1)
+        similar = (similarity >= threshold) & (answers[candidates] == answers[candidate_heads])
+        for candidate, head in zip(candidates[similar], candidate_heads[similar]):
+            union_find.union(int(candidate), int(head))
+    return np.array([union_find.find(row) for row in range(num_rows)], dtype=np.int64)
+
+
+def deduplicate(input_path, output_path, threshold=0.85, num_perm=128, bands=16, ngram=5, num_proc=None, seed=42):
+    """Write the records of `input_path` without duplicates to `output_path`, returns the report."""
+    assert num_perm % bands == 0, f"{num_perm=} must be a multiple of {bands=}"
+    keys, answers, signatures, tasks = compute_signatures(input_path, num_perm, seed, ngram, num_proc or os.cpu_count())
+    num_records = len(keys)
+
+    # exact: the first record of every key
+    _, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    duplicate_of = first_index[inverse]
+    kind = np.where(duplicate_of == np.arange(num_records), 'kept', 'exact').astype(object)
+
+    # near: only among the records left after exact deduplication
+    unique_rows = np.nonzero(kind == 'kept')[0]
+    roots = unique_rows[near_duplicate_roots(signatures[unique_rows], answers[unique_rows], bands, threshold, seed)]
+    near = roots != unique_rows
+    kind[unique_rows[near]] = 'near'
+    duplicate_of[unique_rows[near]] = roots[near]
+
+    report = {'input': input_path, 'output': output_path, 'threshold': threshold, 'num_perm': num_perm, 'bands': bands,
+              'ngram': ngram, 'total': num_records, 'exact': 0, 'near': 0, 'kept': 0, 'tasks': defaultdict(Counter)}
+    removed_path = f'{output_path}.removed.jsonl'
+    with open(input_path, encoding='utf-8') as f, open(output_path, 'w', encoding='utf-8') as out, \
+            open(removed_path, 'w', encoding='utf-8') as removed:
+        for row, line in enumerate(line for line in f if line.strip()):
+            report[kind[row]] += 1
+            report['tasks'][tasks[row] or 'unknown'].update(['total', kind[row]])
+            if kind[row] == 'kept':
+                out.write(line if line.endswith('\n') else line + '\n')
+                continue
+            source = int(duplicate_of[row])
+            removed.write(json.dumps({'line': row, 'kind': kind[row], 'duplicate_of_line': source,
+                                      'duplicate_of_task': tasks[source],
+                                      'similarity': float((signatures[row] == signatures[source]).mean()),
+                                      'record': json.loads(line)}, ensure_ascii=False) + '\n')
+    report['tasks'] = {task: dict(counts) for task, counts in sorted(report['tasks'].items())}
+    with open(f'{output_path}.report.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"{input_path}: kept {report['kept']} of {num_records}, removed {report['exact']} exact and {report['near']} near duplicates")
+    for task, counts in report['tasks'].items():
+        print(f"  {task}: total {counts.get('total', 0)}, exact {counts.get('exact', 0)}, near {counts.get('near', 0)}, kept {counts.get('kept', 0)}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--threshold', type=float, default=0.85, help='estimated Jaccard similarity of near duplicates')
+    parser.add_argument('--num-perm', type=int, default=128)
+    parser.add_argument('--bands', type=int, default=16)
+    parser.add_argument('--ngram', type=int, default=5)
+    parser.add_argument('--num-proc', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    deduplicate(args.input, args.output, threshold=args.threshold, num_perm=args.num_perm, bands=args.bands,
+                ngram=args.ngram, num_proc=args.num_proc, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
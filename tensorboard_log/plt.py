@@ -31,7 +31,11 @@ ea.Reload()
 # 指定感兴趣的标签
 interested_tags = ['actor/kl_loss', 'actor/entropy_loss',  'actor/grad_norm', 
                    'critic/rewards/mean', 'response_length/mean', 'timing_s/step', 
-                   'critic/advantages/mean', 'val-aux/unknown/reward/mean@1']
+                   'critic/advantages/mean', 'val-aux/unknown/reward/mean@1',
+                   # 奖励计算阶段的耗时与奖励模型请求统计，见 RewardManager.pop_metrics
+                   'reward/time/decode', 'reward/time/math', 'reward/time/judge', 'reward/time/score', 
+                   'judge/latency_p50', 'judge/latency_p99', 'judge/peak_in_flight', 'judge/timeouts', 
+                   'verifier_cache/hit_rate', 'reward/deadline_missed']
 
 # 确保输出目录存在
 output_dir = f'/workspace/LLM-Train/LLM-RL/LLM-veRL/tensorboard_log/{strtime}'  # 指定你想要保存图片的目录
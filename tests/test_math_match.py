@@ -0,0 +1,73 @@
+"""The fast tiers of math_match.py must never decide differently from math_verify."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'GRPO_Train'))
+
+math_verify = pytest.importorskip('math_verify')
+
+from math_match import fast_match  # noqa: E402
+
+# (response, reference) pairs around the edges of the fast tiers
+MATH_CASES = [
+    (r'\boxed{3}', '3'),
+    (r'so the answer is \boxed{ 3 }', '3'),
+    (r'\boxed{3}', r'The answer is \boxed{3}.'),
+    (r'\boxed{-3}', '-3'),
+    (r'\boxed{3.0}', '3'),
+    (r'\boxed{0.5}', r'\frac{1}{2}'),
+    (r'\boxed{\frac{1}{2}}', '1/2'),
+    (r'\boxed{\dfrac{1}{2}}', r'\boxed{\frac{1}{2}}'),
+    (r'\boxed{\frac{2}{4}}', '1/2'),
+    (r'\boxed{-\frac{1}{2}}', '-1/2'),
+    (r'\boxed{4}', '3'),
+    (r'\boxed{1000000}', '1000001'),
+    (r'\boxed{12345678901234567}', '12345678901234568'),
+    (r'\boxed{2}', '2.5'),
+    (r'\boxed{3.}', '3'),
+    (r'\boxed{+3}', '3'),
+    (r'\boxed{3}', '+3'),
+    (r'\boxed{A}', 'A'),
+    (r'\boxed{(1,2)}', '(1, 2)'),
+    (r'\boxed{1e3}', '1000'),
+    (r'\fbox{3}', '3'),
+    (r'first \boxed{2}, then \boxed{3}', '3'),
+    (r'\boxed{3}', r'\boxed{3} and \boxed{4}'),
+    (r'\boxed{\text{3}}', '3'),
+    (r'\boxed{3 4}', '34'),
+    (r'\boxed{\frac{1}{0}}', '1'),
+    ('no boxed answer, 3', '3'),
+]
+
+
+@pytest.mark.parametrize('output, target', MATH_CASES)
+def test_math_fast_match_agrees_with_math_verify(output, target):
+    reward, _ = fast_match(output, target, 'math')
+    if reward is not None:
+        # same call as rewards.math_reward
+        assert reward == float(math_verify.verify(math_verify.parse(output), math_verify.parse(target)))
+
+
+@pytest.mark.parametrize('output, limit', [
+    (r'\boxed{2.5}', [2, 3]),
+    (r'\boxed{3}', [2, 3]),
+    (r'\boxed{3.5}', [2, 3]),
+    (r'\boxed{-1}', [0, 1]),
+    (r'\boxed{\frac{5}{2}}', [2, 3]),
+])
+def test_medcalc_fast_match_agrees_with_math_verify(output, limit):
+    reward, _ = fast_match(output, '', 'MedCalc-Bench', limit)
+    if reward is not None:
+        # same check as rewards.medcalc_reward
+        answer = math_verify.parse(output)[0]
+        assert reward == (1.0 if limit[0] <= answer <= limit[1] else 0.0)
+
+
+def test_fast_tiers_decide_plain_numbers():
+    assert fast_match(r'\boxed{3}', '3', 'math')[0] == 1.0
+    assert fast_match(r'\boxed{0.5}', r'\frac{1}{2}', 'math')[0] == 1.0
+    assert fast_match(r'\boxed{4}', '3', 'math')[0] == 0.0
+    assert fast_match(r'\boxed{3.}', '3', 'math')[0] is None
+    assert fast_match(r'first \boxed{2}, then \boxed{3}', '3', 'math') == (None, None)